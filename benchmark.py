@@ -0,0 +1,331 @@
+import os
+import sys
+import io
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import contextlib
+from struct import pack, pack_into
+
+import openpyxl
+
+import undelete
+
+# 生成するファイルの拡張子（undelete.py の既定の復旧対象）
+FILE_EXTENSIONS = ["JPG", "PDF", "PNG", "DOC", "XLS", "PPT", "TXT"]
+# FATエントリの値（未使用・チェーン終端・メディア記述子）
+FREE_CLUSTER = 0x00000000
+END_OF_CHAIN = 0x0FFFFFFF
+MEDIA_DESCRIPTOR = 0x0FFFFFF8
+
+
+def lfn_checksum(short_name: bytes) -> int:
+    """
+    短いファイル名（11バイト）からLFNエントリのチェックサムを求める
+    """
+    checksum = 0
+    for byte in short_name:
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + byte) & 0xFF
+    return checksum
+
+
+def directory_entries(name: str, ext: str, attribute: int, first_cluster: int, size: int, deleted: bool, long_name: str | None, rnd: random.Random) -> list:
+    """
+    ファイル/ディレクトリ1件分のディレクトリエントリ（LFNエントリ＋短いファイル名エントリ）を作成する
+    """
+    short_name = (name.ljust(8)[:8] + ext.ljust(3)[:3]).encode("ascii")
+    entries = []
+    if long_name:
+        # UTF-16LE の名前を13文字ずつLFNエントリに分ける（終端 0x0000、残りは 0xFFFF で埋める）
+        encoded = long_name.encode("utf-16le") + b"\x00\x00"
+        encoded += b"\xff\xff" * (-len(encoded) // 2 % 13)
+        parts = [encoded[i:i + 26] for i in range(0, len(encoded), 26)]
+        checksum = lfn_checksum(short_name)
+        for sequence in range(len(parts), 0, -1):
+            part = parts[sequence - 1]
+            entry = bytearray(32)
+            entry[0] = 0xE5 if deleted else sequence | (0x40 if sequence == len(parts) else 0)
+            entry[1:11] = part[0:10]
+            entry[11] = 0x0F
+            entry[13] = checksum
+            entry[14:26] = part[10:22]
+            entry[28:32] = part[22:26]
+            entries.append(bytes(entry))
+
+    entry = bytearray(32)
+    entry[0:11] = short_name
+    if deleted:
+        entry[0] = 0xE5
+    entry[11] = attribute
+    date = ((rnd.randint(2000, 2024) - 1980) << 9) | (rnd.randint(1, 12) << 5) | rnd.randint(1, 28)
+    time_value = (rnd.randint(0, 23) << 11) | (rnd.randint(0, 59) << 5) | rnd.randint(0, 29)
+    pack_into("<HHHHHHHI", entry, 14, time_value, date, date, first_cluster >> 16, time_value, date, first_cluster & 0xFFFF, size)
+    entries.append(bytes(entry))
+    return entries
+
+
+def generate_image(image_path: str, size_mb: int = 64, cluster_size: int = 4096, files: int = 200, dirs: int = 10, deleted_ratio: float = 0.3, lfn: bool = True, fragmentation: float = 0.2, max_file_clusters: int = 8, seed: int = 1) -> dict:
+    """
+    FAT32のディスクイメージを生成する
+    fragmentation: ファイルのクラスタを割り当てるたびに、数クラスタ飛ばす確率
+    戻り値: 削除されていないファイルの内容 (Key: 先頭クラスタ, Value: データ)
+    """
+    rnd = random.Random(seed)
+    bytes_per_sector = 512
+    reserved_sectors = 32
+    fat_count = 2
+    total_sectors = size_mb * 1024 * 1024 // bytes_per_sector
+    fat_size = (total_sectors // (cluster_size // bytes_per_sector) * 4 + bytes_per_sector - 1) // bytes_per_sector
+    data_start_byte = (reserved_sectors + fat_count * fat_size) * bytes_per_sector
+    total_clusters = (total_sectors * bytes_per_sector - data_start_byte) // cluster_size
+    fat = [FREE_CLUSTER] * (total_clusters + 2)
+    fat[0] = MEDIA_DESCRIPTOR
+    fat[1] = END_OF_CHAIN
+    used = [True, True] + [False] * total_clusters
+    next_free = 2
+
+    def allocate(count: int) -> list:
+        nonlocal next_free
+        chain = []
+        cluster = next_free
+        while len(chain) < count:
+            if cluster >= len(used):
+                raise RuntimeError("イメージの空き容量が足りません。--size-mb を大きくしてね。")
+            if not used[cluster]:
+                if chain and rnd.random() < fragmentation:
+                    # 断片化: 数クラスタ飛ばして割り当てる
+                    cluster += rnd.randint(1, 3)
+                    continue
+                used[cluster] = True
+                chain.append(cluster)
+            cluster += 1
+        while next_free < len(used) and used[next_free]:
+            next_free += 1
+        for current_cluster, following_cluster in zip(chain, chain[1:]):
+            fat[current_cluster] = following_cluster
+        fat[chain[-1]] = END_OF_CHAIN
+        return chain
+
+    contents = {}
+    with open(image_path, "wb") as f:
+        f.truncate(total_sectors * bytes_per_sector)
+
+        def write_chain(chain: list, data: bytes):
+            for index, cluster in enumerate(chain):
+                part = data[index * cluster_size:(index + 1) * cluster_size]
+                if part:
+                    f.seek(data_start_byte + (cluster - 2) * cluster_size)
+                    f.write(part)
+
+        # ディレクトリ: (先頭クラスタ, クラスタチェーン, ディレクトリエントリ)
+        root_chain = allocate(1)
+        directories = [(root_chain[0], root_chain, [])]
+        for index in range(dirs):
+            parent_cluster, _, parent_entries = rnd.choice(directories)
+            chain = allocate(1)
+            deleted = rnd.random() < deleted_ratio / 2
+            long_name = f"Folder number {index} long" if lfn else None
+            parent_entries.extend(directory_entries(f"DIR{index}", "", 0x10, chain[0], 0, deleted, long_name, rnd))
+            # 「.」「..」エントリ（ルートが親の場合、「..」の先頭クラスタは0）
+            dot_parent = 0 if parent_cluster == root_chain[0] else parent_cluster
+            dot = bytearray(32)
+            dot[0:11] = b".          "
+            dot[11] = 0x10
+            pack_into("<H", dot, 20, chain[0] >> 16)
+            pack_into("<H", dot, 26, chain[0] & 0xFFFF)
+            dot_dot = bytearray(32)
+            dot_dot[0:11] = b"..         "
+            dot_dot[11] = 0x10
+            pack_into("<H", dot_dot, 20, dot_parent >> 16)
+            pack_into("<H", dot_dot, 26, dot_parent & 0xFFFF)
+            directories.append((chain[0], chain, [bytes(dot), bytes(dot_dot)]))
+            if deleted:
+                for cluster in chain:
+                    fat[cluster] = FREE_CLUSTER
+
+        for index in range(files):
+            _, _, parent_entries = rnd.choice(directories)
+            ext = rnd.choice(FILE_EXTENSIONS)
+            size = rnd.randint(1, cluster_size * max_file_clusters)
+            chain = allocate((size + cluster_size - 1) // cluster_size)
+            data = rnd.randbytes(size)
+            write_chain(chain, data)
+            deleted = rnd.random() < deleted_ratio
+            long_name = f"File number {index} with a long name.{ext.lower()}" if lfn and rnd.random() < 0.7 else None
+            parent_entries.extend(directory_entries(f"F{index}", ext, 0x20, chain[0], size, deleted, long_name, rnd))
+            if deleted:
+                # 削除済みファイルのクラスタは解放する（後のファイルに再利用される）
+                for cluster in chain:
+                    fat[cluster] = FREE_CLUSTER
+                    used[cluster] = False
+            else:
+                contents[chain[0]] = data
+
+        # ディレクトリエントリを書き込む（1クラスタに収まらない場合はチェーンを延ばす）
+        for _, chain, entries in directories:
+            blob = b"".join(entries)
+            needed = max(1, (len(blob) + cluster_size - 1) // cluster_size)
+            if needed > len(chain):
+                extra = allocate(needed - len(chain))
+                fat[chain[-1]] = extra[0]
+                chain.extend(extra)
+            write_chain(chain, blob)
+
+        # FAT（ミラーも同じ内容）
+        fat_bytes = pack(f"<{len(fat)}I", *fat)
+        for fat_index in range(fat_count):
+            f.seek((reserved_sectors + fat_index * fat_size) * bytes_per_sector)
+            f.write(fat_bytes)
+
+        # ブートセクタ（6セクタ目にバックアップ）
+        boot_sector = bytearray(bytes_per_sector)
+        boot_sector[0:3] = b"\xEB\x58\x90"
+        boot_sector[3:11] = b"MSWIN4.1"
+        pack_into("<HBHB", boot_sector, 11, bytes_per_sector, cluster_size // bytes_per_sector, reserved_sectors, fat_count)
+        boot_sector[21] = 0xF8
+        pack_into("<II", boot_sector, 32, total_sectors, fat_size)
+        pack_into("<IHH", boot_sector, 44, root_chain[0], 1, 6)
+        boot_sector[66] = 0x29
+        boot_sector[71:82] = b"NO NAME    "
+        boot_sector[82:90] = b"FAT32   "
+        boot_sector[510:512] = b"\x55\xaa"
+        for sector in (0, 6):
+            f.seek(sector * bytes_per_sector)
+            f.write(boot_sector)
+    return contents
+
+
+def peak_rss_mb() -> float:
+    """
+    これまでの最大常駐メモリ（MB）を返す（Linux は KB、macOS はバイト単位）
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def timed(function, *args, **kwargs):
+    """
+    関数を実行して経過時間を計る（undelete.py の出力は捨てる）
+    戻り値: (関数の戻り値, 経過秒数)
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+    return result, elapsed
+
+
+def report(label: str, elapsed: float, size_bytes: int | None = None, entries: int | None = None):
+    """
+    1フェーズ分の結果を表示する
+    """
+    line = f"{label:<16} {elapsed:8.3f} 秒"
+    if size_bytes is not None:
+        line += f"  {size_bytes / (1024 * 1024) / elapsed if elapsed else 0:10.1f} MB/s"
+    if entries is not None:
+        line += f"  {entries / elapsed if elapsed else 0:12,.0f} エントリ/s"
+    line += f"  最大RSS {peak_rss_mb():8.1f} MB"
+    print(line)
+
+
+def run_benchmark(image_path: str, work_dir: str, contents: dict | None, jobs: int = 1, strategy: str = "sweep"):
+    """
+    生成したイメージに対して、スキャン→Excel書き出し→パス逆引き→復元の順に時間を計る
+    """
+    image_size = os.path.getsize(image_path)
+    db_file = os.path.join(work_dir, "bench.db")
+    xlsx_file = os.path.join(work_dir, "bench.xlsx")
+    target_exts = [ext for ext in FILE_EXTENSIONS if ext != "TXT"] + ["PAG"]
+
+    # 1. スキャン（read_raw_data）
+    scanned, elapsed = timed(undelete.read_raw_data, image_path, target_exts, db_file, jobs, strategy)
+    if not scanned:
+        sys.exit("❌ スキャンに失敗しました。")
+    conn = undelete.open_store(db_file)
+    undelete.load_store_geometry(conn)
+    entries = list(undelete.iter_store_entries(conn))
+    conn.close()
+    report("read_raw_data", elapsed, image_size, len(entries))
+
+    # 2. Excel 書き出し（save_to_excel）
+    _, elapsed = timed(undelete.save_to_excel, entries, xlsx_file)
+    report("save_to_excel", elapsed, None, len(entries))
+
+    # 3. パス逆引き（lookup_path）
+    _, elapsed = timed(undelete.lookup_path, xlsx_file)
+    report("lookup_path", elapsed, None, len(entries))
+
+    # 4. 復元（salvage_file）: 削除されていないファイルをすべて復元対象にする
+    wb = openpyxl.load_workbook(xlsx_file)
+    ws = wb.active
+    restore_bytes = 0
+    restore_count = 0
+    for row in ws.iter_rows(min_row=2):
+        if row[6].value == "0x20" and row[9].value != "!":
+            row[0].value = 1
+            restore_bytes += int(row[5].value)
+            restore_count += 1
+    wb.save(xlsx_file)
+    restore_dir = os.path.join(work_dir, "restore")
+    os.makedirs(restore_dir, exist_ok=True)
+    current_dir = os.getcwd()
+    os.chdir(restore_dir)
+    try:
+        _, elapsed = timed(undelete.salvage_file, xlsx_file, False, jobs)
+    finally:
+        os.chdir(current_dir)
+    report("salvage_file", elapsed, restore_bytes, restore_count)
+
+    if contents is not None:
+        # 復元したファイルが生成時の内容と一致するか確認
+        wb = openpyxl.load_workbook(xlsx_file, read_only=True)
+        restored = 0
+        matched = 0
+        for row in wb.active.iter_rows(min_row=2, values_only=True):
+            if row[0] == 0:
+                restored += 1
+                with open(os.path.join(restore_dir, "\\".join([row[10], row[3]])), "rb") as f:
+                    matched += f.read() == contents.get(int(row[8]))
+        wb.close()
+        print(f"\n復元したファイル {matched:,}/{restored:,} 件が生成時の内容と一致しました。")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="FAT32イメージを生成して、スキャン・Excel書き出し・パス逆引き・復元の性能を計測"
+    )
+    parser.add_argument("--image", type=str, help="生成せずに既存のイメージファイルで計測する")
+    parser.add_argument("--size-mb", type=int, default=64, help="生成するボリュームのサイズ（MB）")
+    parser.add_argument("--cluster-size", type=int, default=4096, help="クラスタサイズ（バイト、512の倍数）")
+    parser.add_argument("--files", type=int, default=200, help="ファイル数")
+    parser.add_argument("--dirs", type=int, default=10, help="ディレクトリ数")
+    parser.add_argument("--deleted-ratio", type=float, default=0.3, help="削除済みにするファイルの割合（ディレクトリはこの半分）")
+    parser.add_argument("--no-lfn", action="store_true", help="長いファイル名（LFN）エントリを作らない")
+    parser.add_argument("--fragmentation", type=float, default=0.2, help="クラスタ割り当て時に数クラスタ飛ばす確率（断片化の度合い）")
+    parser.add_argument("--max-file-clusters", type=int, default=8, help="1ファイルの最大クラスタ数")
+    parser.add_argument("--seed", type=int, default=1, help="乱数のシード（同じ値なら同じイメージを生成）")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="スキャン・復元の並列数")
+    parser.add_argument("--strategy", choices=["sweep", "tree"], default="sweep", help="スキャン方法")
+    parser.add_argument("--work-dir", type=str, help="作業ディレクトリ（指定時は計測後も残す）")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="fat32_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        contents = None
+        image_path = args.image
+        if image_path is None:
+            image_path = os.path.join(work_dir, "bench.img")
+            start = time.perf_counter()
+            contents = generate_image(
+                image_path, args.size_mb, args.cluster_size, args.files, args.dirs,
+                args.deleted_ratio, not args.no_lfn, args.fragmentation, args.max_file_clusters, args.seed,
+            )
+            print(f"イメージを生成しました: {image_path}（{args.size_mb} MB, {time.perf_counter() - start:.2f} 秒）\n")
+        run_benchmark(os.path.abspath(image_path), work_dir, contents, args.jobs, args.strategy)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
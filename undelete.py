@@ -1,11 +1,28 @@
 import os
+import re
 import sys
+import time
+import contextlib
+import hashlib
+import uuid
+import shutil
+from array import array
 from struct import *
 from datetime import datetime
 from typing import Iterable
+from dataclasses import dataclass, asdict
+from fnmatch import fnmatchcase
 import argparse
+import json
+import mmap
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import openpyxl
-from typing import List
+from openpyxl.cell import WriteOnlyCell
+from typing import Callable, Iterator, List, Tuple
 
 DATA_START_BYTE = 0
 CLUSTER_SIZE = 0
@@ -14,140 +31,1192 @@ BYTES_PER_SECTOR = 0
 FATSize = 0
 TOTAL_SECTORS = 0
 TOTAL_CLUSTERS = 0
+ROOT_CLUSTER = 0
+# 読み込み元（ドライブレター／ブロックデバイス／イメージファイルのパス）
+SOURCE = ""
+# ディスクイメージ内のパーティションの指定（「パス@ボリュームの先頭のバイトオフセット」）
+PARTITION_SOURCE_PATTERN = re.compile(r"(.+)@(\d+)")
+# MBR・GPT の論理セクタサイズ（LBA の単位）として試すサイズ
+PARTITION_SECTOR_SIZES = (512, 4096)
+# MBR のパーティションテーブルの位置とエントリ数
+MBR_TABLE_OFFSET = 446
+MBR_ENTRY = Struct("<B3xB3xII")
+MBR_ENTRIES = 4
+# FAT32 のパーティションタイプ（CHS／LBA、隠しパーティションを含む）
+FAT32_PARTITION_TYPES = {0x0B, 0x0C, 0x1B, 0x1C}
+# 拡張パーティションのタイプ（中の EBR を順に辿る）
+EXTENDED_PARTITION_TYPES = {0x05, 0x0F, 0x85}
+# GPT の保護 MBR のパーティションタイプ
+GPT_PROTECTIVE_TYPE = 0xEE
+# GPT のヘッダ（シグネチャ, パーティションエントリの開始LBA, エントリ数, エントリサイズ）
+GPT_SIGNATURE = b"EFI PART"
+GPT_HEADER = Struct("<8s64xQII")
+# GPT の Basic Data パーティション（FAT32／exFAT／NTFS）のタイプGUID（EBD0A0A2-B9E5-4433-87C0-68B6B72699C7）
+GPT_BASIC_DATA_GUID = bytes.fromhex("A2A0D0EBE5B9334487C068B6B72699C7")
+# バックアップブートセクタの位置（セクタ番号。FAT32 では 6 が標準）
+BACKUP_BOOT_SECTOR = 6
 # 有効なクラスタ番号を抽出するビットマスク
 FAT32_CLUSTER_MASK = 0x0FFFFFFF
+# 不良クラスタを示す値（これ以上は不良 or チェーン終端）
+FAT32_BAD_CLUSTER = 0x0FFFFFF7
+# ディレクトリエントリ1件のサイズ
+DIR_ENTRY_SIZE = 32
+# スキャン時に一度に読み込むサイズ（クラスタ境界に揃えて使用）
+SCAN_BLOCK_SIZE = 4 * 1024 * 1024
+# スキャン開始時にブートセクタを確認するため、先頭から読み込むサイズ
+BOOT_READ_SIZE = 1024 * 1024
+# 復元時に使い回す読み込みバッファのサイズ
+RESTORE_BUFFER_SIZE = 4 * 1024 * 1024
+# イメージ作成時、読めないセクタを読み直す回数
+BAD_SECTOR_RETRIES = 3
+# 進捗を表示する間隔（秒）
+PROGRESS_INTERVAL = 0.5
+# 1件ごとの結果（見つけたエントリ・復元したファイル）を表示するか（--verbose）
+VERBOSE = False
+# ブロックキャッシュの1ブロックのサイズ（セクタサイズの倍数）と最大ブロック数
+CACHE_BLOCK_SIZE = 64 * 1024
+CACHE_BLOCKS = 256
+# ブロックキャッシュのミス時に先読みするブロック数（FAT領域／データ領域）
+CACHE_FAT_READAHEAD = 16
+CACHE_DATA_READAHEAD = 2
+# データ領域でこのブロック数より長い読み込み（復元・カービング）はキャッシュを通さない（FATのブロックを追い出さないため）
+CACHE_BYPASS_BLOCKS = 4
+# スキャン時に別スレッドで先読みしておくブロック数（0: 先読みせず、読み込みと解析を交互に行う）
+READ_AHEAD_BLOCKS = 2
+# スキャン結果ストア（SQLite）のテーブル定義
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    restore_flag INTEGER,
+    current_byte INTEGER NOT NULL,
+    current_cluster INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    filetype TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    attribute TEXT NOT NULL,
+    updatetime TEXT NOT NULL,
+    first_cluster INTEGER NOT NULL,
+    deleted INTEGER NOT NULL,
+    path TEXT NOT NULL DEFAULT '',
+    origin TEXT NOT NULL DEFAULT 'entry',
+    sha256 TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_first_cluster ON entries (first_cluster);
+CREATE INDEX IF NOT EXISTS entries_parent_cluster ON entries (current_cluster);
+CREATE INDEX IF NOT EXISTS entries_filetype ON entries (filetype);
+CREATE INDEX IF NOT EXISTS entries_deleted ON entries (deleted);
+CREATE INDEX IF NOT EXISTS entries_restore_flag ON entries (restore_flag);
+CREATE TABLE IF NOT EXISTS volume (
+    key TEXT PRIMARY KEY,
+    value NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scan_checkpoint (
+    next_byte INTEGER NOT NULL,
+    lfn_buffer TEXT NOT NULL
+);
+"""
+STORE_INSERT = (
+    "INSERT INTO entries (current_byte, current_cluster, filename, filetype, size, attribute, updatetime, first_cluster, deleted, path, origin)"
+    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+# スキャン中にチェックポイントを保存する間隔（バイト）
+CHECKPOINT_INTERVAL = 256 * 1024 * 1024
+# Excelに書き出すストアのID列（Q列）のインデックス
+STORE_ID_COLUMN = 16
+# Excelに書き出す読み込み元の列（R列）のインデックス
+SOURCE_COLUMN = 17
+# Excelに書き出す検出方法の列（S列）のインデックス（entry: ディレクトリエントリ, carve: カービング）
+ORIGIN_COLUMN = 18
+# Excelに書き出す復元したファイルのハッシュ（SHA-256）の列（T列）のインデックス
+SHA256_COLUMN = 19
+# ストアの volume テーブルでスキャンの識別子を保存するキー
+SCAN_ID_KEY = "SCAN_ID"
+# 古いストアに追加する列（列名 → 定義）
+STORE_MIGRATIONS = {
+    "origin": "TEXT NOT NULL DEFAULT 'entry'",
+    "sha256": "TEXT",
+}
+
+
+def resolve_paths(scan_results: List[dict]):
+    """
+    メモリ上のスキャン結果から親ディレクトリを逆引きし、各エントリに「場所」 (path) を設定する
+    ディレクトリ（格納場所のクラスタ）ごとに求めたパスをキャッシュするため、全体の処理量はエントリ数に比例する
+    親ディレクトリが見つからないエントリは ROOT、親の連鎖が循環しているエントリは ORPHAN から始まるパスになる
+    """
+    # 🚨 最重要: 削除されていないディレクトリのエントリのみを親の候補として辞書に登録する
+    # Key: ディレクトリの先頭クラスタ番号, Value: (ディレクトリ名, そのディレクトリの格納場所)
+    parent_lookup = {
+        entry["first_cluster"]: (entry["filename"], entry["current_cluster"])
+        for entry in scan_results
+        if entry["attribute"] == "0x10" and not entry["deleted"]
+    }
+    # Key: 格納場所のクラスタ番号, Value: パス
+    path_cache = {}
+    for entry in scan_results:
+        # カービングで見つけたファイルには親ディレクトリがない
+        if entry.get("origin") == "carve":
+            continue
+        entry["path"] = resolve_location(entry["current_cluster"], parent_lookup, path_cache)
+
+
+def resolve_location(location_cluster: int, parent_lookup: dict, path_cache: dict) -> str:
+    """
+    格納場所（クラスタ番号）からルートまで親ディレクトリを辿ってパスを求める
+    途中で通ったディレクトリのパスもすべて path_cache に登録する
+    """
+    # 親を辿る途中の、パスが未確定のクラスタ
+    walk = []
+    walking = set()
+    current_location_cluster = location_cluster
+    while True:
+        if current_location_cluster in path_cache:
+            base_path = path_cache[current_location_cluster]
+            break
+        if current_location_cluster in walking:
+            # 親の連鎖が循環している（壊れたメタデータ）
+            base_path = "ORPHAN"
+            break
+        parent_entry = parent_lookup.get(current_location_cluster)
+        if parent_entry is None:
+            # 親が見つからなかった場合（ルートに到達 or 孤立）
+            base_path = "ROOT"
+            path_cache[current_location_cluster] = base_path
+            break
+        walk.append(current_location_cluster)
+        walking.add(current_location_cluster)
+        current_location_cluster = parent_entry[1]
+        # ルートディレクトリ（クラスタ0 or 2）に格納されている
+        if current_location_cluster == 0 or current_location_cluster == 2:
+            base_path = "ROOT"
+            break
+
+    # 親に近い方から順にパスを確定させる
+    for cluster in reversed(walk):
+        base_path = f"{base_path}\\{parent_lookup[cluster][0]}"
+        path_cache[cluster] = base_path
+    return path_cache[location_cluster]
 
 
 def lookup_path(excel_file_path: str):
     """
-    Excelファイルから、親ディレクトリ特定用の辞書を作成する
-    Key: ディレクトリの先頭クラスタ番号 (int)
-    Value: そのディレクトリの全情報 (dict)
+    Excelファイルの各行について親ディレクトリを逆引きし、「場所」列に書き込む（スキャン結果ストアがない場合）
     """
     wb = openpyxl.load_workbook(excel_file_path)
     ws = wb.active
-    
-    parent_lookup = {}
-    
-    # １周目（ディレクトリ辞書の作成）
-    # ヘッダー行をスキップ (min_row=2)
-    for row in ws.iter_rows(min_row=2):
-        
-        # 必要な列の値を抽出 (値は row[index].value で取得)
-        # 属性: Index 6, 先頭クラスタ: Index 8, クラスタ位置: Index 2
-        
-        attribute = row[6].value
-        first_cluster = row[8].value
-        delete_frag = row[9].value
-        
-        # 🚨 最重要: ディレクトリのエントリのみを候補として辞書に登録する
-        # (ファイルエントリは親にはなれない。LFNエントリはスキップ)
-        if attribute == '0x10' and delete_frag != '!':  # ディレクトリ属性で削除フラグが立っていない
-            
-            # 先頭クラスタをキーとし、そのディレクトリの情報を値として格納
-            # ここではシンプルに、全ての列をタプルとして値にする
-            # 実際にはタプルではなく、辞書に変換した方が扱いやすいです
-            parent_lookup[int(first_cluster)] = {
-                "filename": row[3].value,
-                "cluster_location": int(row[2].value),
-                "entry_row_data": [cell.value for cell in row]
-            }
-
-    # ２周目（パスの特定と書き込み）
-    # ヘッダー行をスキップ (min_row=2)
-    for row in ws.iter_rows(min_row=2):
-        # 現在チェックしているファイルの「格納場所（クラスタ位置）」
-        current_location_cluster = int(row[2].value)
-        attribute = row[6].value
-        # フルパスを保存するリスト（最初は自分自身のファイル名）
-        path_list = []
-        while True:
-            # 辞書から親ディレクトリを探す
-            # parent_lookup のキーは「先頭クラスタ」= 子ファイルの「格納場所」
-            parent_entry = parent_lookup.get(current_location_cluster)
-
-            if parent_entry:
-                # 親が見つかった場合
-                parent_name = parent_entry['filename']
-                path_list.insert(0, parent_name) # リストの先頭に追加
-                
-                # 次の検索のために、キーを「親の格納場所」に更新してループ継続
-                current_location_cluster = int(parent_entry['cluster_location'])
-                
-                # ※無限ループ防止（ルートディレクトリ自身を指している場合などの対策）
-                if current_location_cluster == 0 or current_location_cluster == 2:
-                    path_list.insert(0, "ROOT")
-                    break
-            else:
-                # 親が見つからなかった場合（ルートに到達 or 孤立）
-                path_list.insert(0, "ROOT")
-                break
+    rows = list(ws.iter_rows(min_row=2))
+    # 属性: Index 6, 先頭クラスタ: Index 8, クラスタ位置: Index 2, 削除フラグ: Index 9
+    scan_results = [
+        {
+            "filename": row[3].value,
+            "current_cluster": int(row[2].value),
+            "attribute": row[6].value,
+            "first_cluster": int(row[8].value),
+            "deleted": row[9].value == "!",
+            "origin": row[ORIGIN_COLUMN].value if len(row) > ORIGIN_COLUMN else "entry",
+            "path": row[10].value,
+        }
+        for row in rows
+    ]
+    resolve_paths(scan_results)
+    for row, entry in zip(rows, scan_results):
+        row[10].value = entry["path"]
 
-        # リストを繋げてパスにする
-        full_path = "\\".join(path_list)
-        if full_path != "ROOT":
-            print(f"復元パス: {full_path}")
-        row[10].value = full_path
-    
-    # 3. ファイルの保存
+    # ファイルの保存
     try:
         wb.save(excel_file_path)
         print(f"\n✅ Excelファイルに保存が完了しました: {excel_file_path}")
     except Exception as e:
         print(f"\n❌ ファイル保存中にエラーが発生しました: {e}")
 
-def salvage_file(excel_file_path: str):
-    global DATA_START_BYTE, CLUSTER_SIZE, RESERVED_SECTORS, BYTES_PER_SECTOR
+
+def volume_path(source: str) -> str:
+    """
+    読み込み元の指定（ドライブレター／ブロックデバイス／イメージファイルのパス）から、開くパスを求める
+    """
+    # ドライブレター（"D" or "D:"）は、Windowsでは「\\.\」を前につけて特殊なデバイスとして扱う必要があるわ。
+    if re.fullmatch(r"[A-Za-z]:?", source):
+        return f"\\\\.\\{source[0]}:"
+    return source
+
+
+def split_source(source: str) -> Tuple[str, int]:
+    """
+    読み込み元の指定を (パス, ボリュームの先頭のバイトオフセット) に分ける
+    ディスクイメージ内のパーティションは「パス@オフセット」で指定する（そのままのパスのファイルがあればファイル名の一部とみなす）
+    """
+    match = PARTITION_SOURCE_PATTERN.fullmatch(source)
+    if match is None or os.path.exists(source):
+        return source, 0
+    return match.group(1), int(match.group(2))
+
+
+def override_source(stored: str | None, override: str | None) -> str | None:
+    """
+    復元時の読み込み元を返す（--target_drive の指定はスキャン時の読み込み元より優先）
+    パーティション（「パス@オフセット」）をスキャンした結果に、オフセットなしで同じイメージを指定した場合はオフセットを引き継ぐ
+    """
+    if not override:
+        return stored
+    if not stored:
+        return override
+    stored_path, stored_base = split_source(stored)
+    override_path, override_base = split_source(override)
+    if not stored_base or override_base:
+        return override
+    if volume_path(override_path) == override_path and os.path.abspath(override_path) == stored_path:
+        return f"{override_path}@{stored_base}"
+    print(f"⚠ スキャン時の読み込み元はパーティション（{stored}）です。ディスク全体を指定した場合は「{override}@{stored_base}」のようにオフセットを付けてね。")
+    return override
+
+
+def absolute_source(source: str) -> str:
+    """
+    ストアに記録する読み込み元を返す（別のディレクトリから復元できるよう、イメージ・デバイスのパスは絶対パスにする）
+    """
+    path, base = split_source(source)
+    # ドライブレターはそのまま
+    if volume_path(path) != path:
+        return source
+    path = os.path.abspath(path)
+    return f"{path}@{base}" if base else path
+
+
+class BlockCache:
+    """
+    セクタ境界に揃えたブロック単位のLRUキャッシュ（mmap できない読み込み元で使用）
+    ミス時は、FAT領域とデータ領域でそれぞれ指定したブロック数だけ先読みする
+    """
+
+    def __init__(self, block_size: int = CACHE_BLOCK_SIZE, capacity: int = CACHE_BLOCKS, fat_readahead: int = CACHE_FAT_READAHEAD, data_readahead: int = CACHE_DATA_READAHEAD, bypass_blocks: int = CACHE_BYPASS_BLOCKS):
+        self.block_size = block_size
+        self.capacity = max(1, capacity)
+        self.fat_readahead = max(1, fat_readahead)
+        self.data_readahead = max(1, data_readahead)
+        self.bypass_blocks = max(1, bypass_blocks)
+        # Key: ブロック番号, Value: ブロックのデータ（終端のブロックは短い）
+        self.blocks = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def bypasses(self, offset: int, size: int) -> bool:
+        """
+        キャッシュを通さない読み込みか
+        データ領域で bypass_blocks ブロックより長い読み込み（スイープ・復元など）と、キャッシュ容量の1/4以上の読み込み
+        """
+        if offset >= DATA_START_BYTE and size > self.bypass_blocks * self.block_size:
+            return True
+        return size * 4 >= self.block_size * self.capacity
+
+    def read(self, read_device: Callable[[int, int], memoryview], offset: int, size: int) -> memoryview:
+        """
+        offset から size バイトを返す（終端では短くなる）
+        read_device: ブロック境界の位置とサイズを指定してデバイスから読み込む関数
+        """
+        first_block = offset // self.block_size
+        last_block = (offset + size - 1) // self.block_size
+        start = offset - first_block * self.block_size
+        parts = []
+        for block_number in range(first_block, last_block + 1):
+            block = self._block(read_device, block_number)
+            parts.append(block)
+            if len(block) < self.block_size:
+                # デバイスの終端
+                break
+        if len(parts) == 1:
+            return memoryview(parts[0])[start:start + size]
+        return memoryview(b"".join(parts))[start:start + size]
+
+    def _block(self, read_device: Callable[[int, int], memoryview], block_number: int) -> bytes:
+        with self.lock:
+            block = self.blocks.get(block_number)
+            if block is not None:
+                self.blocks.move_to_end(block_number)
+                self.hits += 1
+                return block
+            self.misses += 1
+        # 先読みするブロック数（FAT領域とデータ領域で別々に設定）
+        position = block_number * self.block_size
+        fat_start = RESERVED_SECTORS * BYTES_PER_SECTOR
+        readahead = self.fat_readahead if fat_start <= position < DATA_START_BYTE else self.data_readahead
+        data = read_device(position, min(readahead, self.capacity) * self.block_size)
+        with self.lock:
+            for index in range(0, max(len(data), 1), self.block_size):
+                self.blocks[block_number + index // self.block_size] = bytes(data[index:index + self.block_size])
+            while len(self.blocks) > self.capacity:
+                self.blocks.popitem(last=False)
+        return bytes(data[:self.block_size])
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        return f"ブロックキャッシュ: ヒット {self.hits:,} 件 / ミス {self.misses:,} 件（ヒット率 {self.hits / total if total else 0:.1%}）"
+
+
+class Volume:
+    """
+    スキャン・復元の読み込み元（ドライブレター／ブロックデバイス／イメージファイル）
+    一度だけ開き、mmap できる場合はセクタ・クラスタをコピーなしの memoryview として返す
+    mmap できない場合（Windowsのドライブなど）はスレッドごとのファイルハンドルから、セクタ境界に揃えて読み込む
+    （小さな読み込みはブロックキャッシュを通す）
+    """
+
+    def __init__(self, source: str, use_mmap: bool = True, use_cache: bool = True):
+        self.source = source
+        path, self.base = split_source(source)
+        self.path = volume_path(path)
+        self.handles = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        f = self._handle()
+        # サイズが取得できない場合（ドライブなど）は 0
+        try:
+            device_size = f.seek(0, os.SEEK_END)
+        except OSError:
+            device_size = 0
+        self.size = max(device_size - self.base, 0)
+        self.map = None
+        self.view = None
+        if use_mmap and self.size:
+            try:
+                # ブロックデバイスは stat のサイズが 0 のため、長さを明示する
+                self.map = mmap.mmap(f.fileno(), device_size, access=mmap.ACCESS_READ)
+                self.view = memoryview(self.map)[self.base:]
+            except (OSError, ValueError):
+                self.map = None
+        # 読み込める終端（パーティションの場合のみ。limit_to_boot_sector で設定する）
+        self.end = None
+        # 読み込み回数とバイト数（実行統計用）
+        self.read_calls = 0
+        self.bytes_read = 0
+        self.cache = None
+        if self.map is None and use_cache:
+            self.cache = BlockCache(CACHE_BLOCK_SIZE, CACHE_BLOCKS, CACHE_FAT_READAHEAD, CACHE_DATA_READAHEAD, CACHE_BYPASS_BLOCKS)
+
+    def _handle(self):
+        """
+        呼び出し元スレッド専用のファイルハンドルを返す（シーク位置をスレッド間で共有しないため）
+        """
+        f = getattr(self.local, "file", None)
+        if f is None:
+            f = open(self.path, "rb", buffering=0)
+            self.local.file = f
+            with self.lock:
+                self.handles.append(f)
+        return f
+
+    def read(self, offset: int, size: int, buffer: memoryview | None = None) -> memoryview:
+        """
+        offset から size バイトを返す（終端では短くなる）
+        mmap 時はマッピングのスライス、それ以外は buffer（省略時は新しいバイト列）に読み込んだもの
+        """
+        if self.end is not None:
+            size = max(0, min(size, self.end - offset))
+        if self.view is not None:
+            data = self.view[offset:offset + size]
+        elif self.cache is not None and not self.cache.bypasses(offset, size):
+            data = self.cache.read(self._read_device, offset, size)
+        else:
+            data = self._read_device(offset, size, buffer)
+        with self.lock:
+            self.read_calls += 1
+            self.bytes_read += len(data)
+        return data
+
+    def limit_to_boot_sector(self):
+        """
+        パーティション（「パス@オフセット」）の場合、ブートセクタのボリュームサイズ（TOTAL_SECTORS）より後ろを読まないようにする
+        （ディスクイメージでは後ろに別のパーティションが続くため）
+        """
+        if not self.base or not TOTAL_SECTORS:
+            return
+        self.end = TOTAL_SECTORS * BYTES_PER_SECTOR
+        self.size = min(self.size, self.end) if self.size else self.end
+
+    def will_need(self, offset: int, size: int):
+        """
+        mmap 時、これから読む範囲をカーネルに先読みさせる（madvise が使えない環境では何もしない）
+        """
+        if self.map is None or not hasattr(mmap, "MADV_WILLNEED") or offset >= self.size:
+            return
+        start = (self.base + offset) // mmap.PAGESIZE * mmap.PAGESIZE
+        self.map.madvise(mmap.MADV_WILLNEED, start, self.base + min(offset + size, self.size) - start)
+
+    def _read_device(self, offset: int, size: int, buffer: memoryview | None = None) -> memoryview:
+        """
+        セクタ境界に揃えてデバイスから読み込み、offset から size バイトを返す
+        """
+        # パーティションの先頭はセクタ境界にあるため、デバイス上の位置に直してから揃える
+        offset += self.base
+        sector_size = BYTES_PER_SECTOR or 512
+        start = offset // sector_size * sector_size
+        end = -(-(offset + size) // sector_size) * sector_size
+        f = self._handle()
+        f.seek(start)
+        if buffer is not None and start == offset and end == offset + size:
+            return buffer[:f.readinto(buffer[:size]) or 0]
+        return memoryview(f.read(end - start))[offset - start:offset - start + size]
+
+    def close(self):
+        if self.map is not None:
+            try:
+                self.view.release()
+                self.map.close()
+            except BufferError:
+                # スライスが残っている間は閉じられない（参照が消えた時点で解放される）
+                pass
+            self.map = None
+            self.view = None
+        for f in self.handles:
+            f.close()
+        self.handles = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ImagingVolume(Volume):
     """
-    Excelファイルの「復旧チェック」列を見て、「1」の時、復旧する
+    読み込み元を先頭から順にイメージファイルへコピーしながら、読み込んだデータをそのまま返すボリューム（劣化したメディア向け）
+    読めないセクタは BAD_SECTOR_RETRIES 回まで読み直し、それでも読めなければ 0 で埋めて不良ブロックとして記録する
+    コピー済みの範囲をもう一度読む場合は、メディアではなくイメージファイルから読み込む
+    """
+
+    def __init__(self, source: str, image_path: str):
+        # 不良セクタで SIGBUS にならないよう、メディアは mmap せずに読み込む（読めないセクタの周辺を先読みしないようキャッシュも使わない）
+        super().__init__(source, use_mmap=False, use_cache=False)
+        self.image_path = image_path
+        self.image = open(image_path, "w+b")
+        # 先頭からコピー済みのバイト数
+        self.copied = 0
+        # 読めなかった範囲 (バイト位置, バイト数)
+        self.bad_ranges = []
+        # 先読みスレッドとカービングの読み込みが重なっても、コピー済みの位置がずれないようにする
+        self.image_lock = threading.RLock()
+
+    def read(self, offset: int, size: int, buffer: memoryview | None = None) -> memoryview:
+        with self.image_lock:
+            return self._read_image(offset, size)
+
+    def _read_image(self, offset: int, size: int) -> memoryview:
+        if offset == self.copied:
+            # 順次読み込み: メディアから読んだバッファをイメージに書き込み、そのまま返す
+            data = self._read_media(offset, size)
+            self.image.seek(offset)
+            self.image.write(data)
+            self.copied += len(data)
+            return data
+        self.copy_until(offset + size)
+        self.image.seek(offset)
+        return memoryview(self.image.read(max(0, min(size, self.copied - offset))))
+
+    def copy_until(self, end: int):
+        """
+        end バイト目（メディアの終端が先ならそこ）までをイメージファイルにコピーする
+        """
+        while self.copied < end:
+            if not self.read(self.copied, min(SCAN_BLOCK_SIZE, end - self.copied)):
+                break
+
+    def _read_media(self, offset: int, size: int) -> memoryview:
+        """
+        メディアから読み込む。ブロック単位で読めなければ、セクタ単位で読み直す
+        """
+        try:
+            return super().read(offset, size)
+        except OSError:
+            pass
+        sector_size = BYTES_PER_SECTOR or 512
+        data = bytearray()
+        for sector_offset in range(offset, offset + size, sector_size):
+            length = min(sector_size, offset + size - sector_offset)
+            sector = None
+            for attempt in range(BAD_SECTOR_RETRIES):
+                try:
+                    sector = super().read(sector_offset, length)
+                    break
+                except OSError:
+                    continue
+            if sector is None:
+                # 読めないセクタは 0 で埋める
+                if self.bad_ranges and sum(self.bad_ranges[-1]) == sector_offset:
+                    self.bad_ranges[-1] = (self.bad_ranges[-1][0], self.bad_ranges[-1][1] + length)
+                else:
+                    self.bad_ranges.append((sector_offset, length))
+                print(f"⚠ {sector_offset:,} バイト目のセクタが読めません。0 で埋めます。")
+                sector = bytes(length)
+            data += sector
+            if len(sector) < length:
+                # メディアの終端
+                break
+        return memoryview(data)
+
+    def close(self):
+        if not self.image.closed:
+            self.image.close()
+            # 不良ブロックマップ（読めなかった範囲）を書き出す
+            with open(f"{self.image_path}.badblocks", "w", encoding="utf-8") as map_file:
+                map_file.write("# 読めなかった範囲（バイト位置, バイト数）\n")
+                for bad_offset, bad_length in self.bad_ranges:
+                    map_file.write(f"{bad_offset}\t{bad_length}\n")
+            print(f"\n✅ イメージファイルを作成しました: {self.image_path}（{self.copied:,} バイト）")
+            if self.bad_ranges:
+                print(f"⚠ 読めなかった範囲 {len(self.bad_ranges)} 件、計 {sum(length for _, length in self.bad_ranges):,} バイトを 0 で埋めました: {self.image_path}.badblocks")
+        super().close()
+
+
+# 読み込み元ごとに開いたボリューム
+volumes = {}
+
+
+def open_volume(source: str) -> Volume:
+    """
+    読み込み元のボリュームを返す（初回のみ開く）
+    """
+    if source not in volumes:
+        volumes[source] = Volume(source)
+        volumes[source].limit_to_boot_sector()
+    return volumes[source]
+
+
+class BootSectorError(ValueError):
+    """
+    読み込み元の先頭が有効なブートセクタではない
+    """
+
+
+@dataclass
+class DirEntry:
+    """
+    スキャンで見つけたエントリ1件（ScanSession が返す。フィールドはスキャン結果の辞書と同じ）
+    """
+    current_byte: int
+    current_cluster: int
+    filename: str
+    filetype: str
+    size: int
+    attribute: str
+    updatetime: str
+    first_cluster: int
+    deleted: bool
+    path: str = ""
+    origin: str = "entry"
+
+    @property
+    def is_directory(self) -> bool:
+        return self.attribute == "0x10"
+
+    @property
+    def modified(self) -> datetime | None:
+        """
+        更新日時（カービングで見つけたファイルは None）
+        """
+        return datetime.strptime(self.updatetime, "%Y-%m-%d %H:%M:%S") if self.updatetime else None
+
+    def as_dict(self) -> dict:
+        """
+        スキャン結果の辞書（ストア・Excelへの書き出しと同じ形式）に変換する
+        """
+        return asdict(self)
+
+
+def fat_timestamp(value: datetime) -> int:
+    """
+    日時を、ディレクトリエントリの更新日と更新時刻を並べた値（更新日 << 16 | 更新時刻）に変換する（大小比較用、秒は2秒単位に切り捨て）
+    FATで表せない日時は、1980年より前なら -1、2107年より後なら 1 << 32
+    """
+    if value.year < 1980:
+        return -1
+    if value.year > 2107:
+        return 1 << 32
+    date_value = (value.year - 1980) << 9 | value.month << 5 | value.day
+    time_value = value.hour << 11 | value.minute << 5 | value.second // 2
+    return date_value << 16 | time_value
+
+
+@dataclass
+class ScanFilter:
+    """
+    スキャンで返すファイルの条件（ディレクトリはパスの逆引きに使うため、常に返す）
+    デコード前の値で判定できる条件（削除済み・サイズ・更新日時・ASCIIの拡張子）は、名前や日時をデコードする前に確かめる
+    extensions: 拡張子（None: すべて。LFNが「.pages」で終わるファイルは常に対象）
+    name: ファイル名のパターン（glob、大文字・小文字は区別しない）
+    min_size / max_size: ファイルサイズの範囲（バイト、両端を含む）
+    modified_after / modified_before: 更新日時の範囲（両端を含む）
+    deleted_only: 削除済みのファイルのみ
+    """
+    extensions: Iterable[str] | None = None
+    name: str | None = None
+    min_size: int | None = None
+    max_size: int | None = None
+    modified_after: datetime | None = None
+    modified_before: datetime | None = None
+    deleted_only: bool = False
+
+    def __post_init__(self):
+        if self.extensions is not None:
+            self.extensions = frozenset(extension.upper() for extension in self.extensions)
+        # 更新日時の範囲は、デコード前の更新日・更新時刻のまま比較できる値にしておく
+        self.after_stamp = None if self.modified_after is None else fat_timestamp(self.modified_after)
+        self.before_stamp = None if self.modified_before is None else fat_timestamp(self.modified_before)
+
+    def rejects_raw(self, data: bytes, extension_bytes: bytes, file_size: int, date_value: int, time_value: int, lfn_buffer: list) -> bool:
+        """
+        ファイルのエントリを、デコード前の値だけで対象外と判定できれば True（安い条件から順に確かめる）
+        """
+        if self.deleted_only and data[0] != 0xE5:
+            return True
+        if self.min_size is not None and file_size < self.min_size:
+            return True
+        if self.max_size is not None and file_size > self.max_size:
+            return True
+        stamp = date_value << 16 | time_value
+        if self.after_stamp is not None and stamp < self.after_stamp:
+            return True
+        if self.before_stamp is not None and stamp > self.before_stamp:
+            return True
+        if self.extensions is not None and not extension_bytes.translate(None, PRINTABLE_ASCII):
+            # 拡張子が印字可能なASCIIだけなら、デコード後の拡張子と同じになる
+            if extension_bytes.decode("ascii").strip() not in self.extensions and not self.may_be_pages(lfn_buffer):
+                return True
+        return False
+
+    @staticmethod
+    def may_be_pages(lfn_buffer: list) -> bool:
+        """
+        LFNが「.pages」で終わる可能性があるか（LFNのバイト列に「.pages」が含まれるか）
+        """
+        return bool(lfn_buffer) and PAGES_SUFFIX_UTF16 in b"".join(part["bytes"] for part in sorted(lfn_buffer, key=lambda part: part["seq"]))
+
+    def accepts(self, filename: str, filetype: str, modified: datetime) -> bool:
+        """
+        デコードしたファイルのエントリが条件に一致するか
+        """
+        if self.extensions is not None and not (filetype in self.extensions or filename[-6:] == ".pages"):
+            return False
+        if self.name is not None and not fnmatchcase(filename.lower(), self.name.lower()):
+            return False
+        if self.modified_after is not None and modified < self.modified_after:
+            return False
+        if self.modified_before is not None and modified > self.modified_before:
+            return False
+        return True
+
+    def accepts_carved(self, filetype: str, size: int) -> bool:
+        """
+        カービングで見つけたファイルが条件に一致するか（名前・日時・削除済みは分からないため、拡張子とサイズのみ）
+        """
+        if self.extensions is not None and filetype not in self.extensions:
+            return False
+        if self.min_size is not None and size < self.min_size:
+            return False
+        if self.max_size is not None and size > self.max_size:
+            return False
+        return True
+
+
+class ReadAhead:
+    """
+    スキャン範囲をブロック単位で読み込み、(ブロックの先頭バイト位置, データ) を順に返す
+    depth > 0 の場合は別スレッドで depth ブロック先まで読み込んでおき、デバイスの読み込みと解析を重ねる
+    読み込み先のバッファ（bytearray）は depth + 1 個を使い回す（mmap 時はコピーせず、先のブロックをカーネルに先読みさせる）
+    返したデータは、次のブロックを受け取った時点で上書きされる
+    """
+
+    def __init__(self, volume: Volume, start: int, end: int | None, block_size: int, depth: int = 0):
+        self.volume = volume
+        self.start = start
+        self.end = end
+        self.block_size = block_size
+        self.depth = depth
+        self.thread = None
+        if depth <= 0:
+            return
+        # 読み込み済みのブロック（終端では None、読み込みエラーでは例外）
+        self.ready = queue.Queue()
+        # 空いているバッファ（mmap 時は先読みできるブロック数を数えるだけの None）
+        self.free = queue.Queue()
+        for _ in range(depth + 1):
+            self.free.put(memoryview(bytearray(block_size)) if volume.map is None else None)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _blocks(self):
+        """
+        ブロックを先頭から順に読み込むジェネレータ（終端・32バイトに満たない端数を読んだら終わる）
+        """
+        block_start = self.start
+        while self.end is None or block_start < self.end:
+            size = self.block_size if self.end is None else min(self.block_size, self.end - block_start)
+            data = self.volume.read(block_start, size)
+            yield block_start, data
+            if not data or len(data) % DIR_ENTRY_SIZE:
+                break
+            block_start += len(data)
+
+    def _run(self):
+        """
+        先読みスレッド: 空いたバッファに次のブロックを読み込んでキューに入れる（mmap 時はカーネルに先読みさせる）
+        """
+        block_start = self.start
+        try:
+            while self.end is None or block_start < self.end:
+                buffer = self.free.get()
+                if self.stopped.is_set():
+                    return
+                size = self.block_size if self.end is None else min(self.block_size, self.end - block_start)
+                self.volume.will_need(block_start, size)
+                data = self.volume.read(block_start, size, buffer)
+                self.ready.put((block_start, data, buffer))
+                if not data or len(data) % DIR_ENTRY_SIZE:
+                    break
+                block_start += len(data)
+        except BaseException as e:
+            # 読み込みエラーは解析側のスレッドで送出する
+            self.ready.put(e)
+            return
+        self.ready.put(None)
+
+    def __iter__(self):
+        if self.thread is None:
+            yield from self._blocks()
+            return
+        while True:
+            item = self.ready.get()
+            if item is None:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            block_start, data, buffer = item
+            yield block_start, data
+            # 解析が終わったバッファを先読みスレッドに返す
+            self.free.put(buffer)
+
+    def close(self):
+        if self.thread is not None:
+            self.stopped.set()
+            self.free.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ProgressReporter:
+    """
+    進捗（処理済みバイト数・クラスタ位置・MB/s・件数/s・残り時間）を PROGRESS_INTERVAL 秒ごとに1行で表示する
+    start, end: 処理するバイト範囲（復元時は 0 から合計サイズ）
+    """
+
+    def __init__(self, start: int, end: int, unit: str = "エントリ", show_cluster: bool = True):
+        self.start = start
+        self.end = end
+        self.unit = unit
+        self.show_cluster = show_cluster
+        self.position = start
+        self.count = 0
+        self.started = time.perf_counter()
+        self.last_report = self.started
+        self.line_length = 0
+        self.finished = False
+
+    def advance(self, position: int, count: int = 0):
+        """
+        処理済みの位置と、新たに見つかった（処理した）件数を反映する
+        """
+        self.position = position
+        self.count += count
+        now = time.perf_counter()
+        if now - self.last_report >= PROGRESS_INTERVAL:
+            self.last_report = now
+            # 端末では同じ行を上書きする
+            self._report(now, "\r" if sys.stdout.isatty() else "\n")
+
+    def finish(self):
+        """
+        最終的な進捗を表示して改行する（2回目以降は何もしない）
+        """
+        if not self.finished:
+            self.finished = True
+            self._report(time.perf_counter(), "\n")
+
+    def _report(self, now: float, end: str):
+        elapsed = max(now - self.started, 1e-9)
+        done = self.position - self.start
+        total = max(self.end - self.start, done)
+        rate = done / elapsed
+        line = f"{done / 1024 / 1024:,.1f}/{total / 1024 / 1024:,.1f} MB"
+        if self.show_cluster and CLUSTER_SIZE:
+            # 処理済みのクラスタ数（ボリューム終端より後ろの端数は含めない）
+            line += f"  クラスタ {min((self.position - DATA_START_BYTE) // CLUSTER_SIZE, TOTAL_CLUSTERS):,}/{TOTAL_CLUSTERS:,}"
+        line += f"  {rate / 1024 / 1024:,.1f} MB/s  {self.count / elapsed:,.0f} {self.unit}/s"
+        line += f"  残り {(total - done) / rate if rate else 0:,.0f} 秒"
+        # 前の行より短い場合は空白で消す
+        print(line.ljust(self.line_length), end=end, flush=True)
+        self.line_length = len(line)
+
+
+class RunStats:
+    """
+    実行統計（フェーズごとの所要時間・読み込みバイト数・読み込み回数・件数）を集計し、--stats-json でJSONに書き出す
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.counters = {}
+        self.started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """
+        with ブロックの所要時間をフェーズ name に加算する
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_volume(self, volume: Volume):
+        """
+        ボリュームの読み込み回数・バイト数（とブロックキャッシュのヒット/ミス）を加算する
+        """
+        self.count("read_calls", volume.read_calls)
+        self.count("bytes_read", volume.bytes_read)
+        if volume.cache is not None:
+            self.count("cache_hits", volume.cache.hits)
+            self.count("cache_misses", volume.cache.misses)
+
+    def save(self, json_path: str, command: str, source: str | None):
+        stats = {
+            "command": command,
+            "source": source,
+            "total_seconds": time.perf_counter() - self.started,
+            "phases": self.phases,
+            **self.counters,
+        }
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(stats, f, ensure_ascii=False, indent=2)
+        print(f"実行統計を書き出しました: {json_path}")
+
+
+# この実行の統計（--stats-json）
+run_stats = RunStats()
+
+
+def restore_job(job: dict, thread_state: threading.local) -> int:
+    """
+    復元ジョブ1件分（親ディレクトリ作成→データ書き込み→日時設定）を実行する（ワーカースレッドで実行）
+    戻り値: 書き込んだバイト数
+    """
+    # スレッドごとに読み込みバッファを使い回す
+    if not hasattr(thread_state, "buffer"):
+        thread_state.buffer = bytearray(RESTORE_BUFFER_SIZE)
+    # 親ディレクトリを作成
+    os.makedirs(job["parent_dir"], exist_ok=True)
+    # 前回の出力がハードリンクの場合に、リンク先まで書き換えないよう先に削除する
+    if os.path.lexists(job["path"]):
+        os.remove(job["path"])
+    # 連続したクラスタをまとめて読み込み、出力ファイルへ直接書き込む（書き込みながらハッシュを計算）
+    digest = hashlib.sha256()
+    written_size = restore_extents(job["source"], job["extents"], job["size"], job["path"], thread_state.buffer, digest, job["data_start_byte"], job["cluster_size"])
+    job["sha256"] = digest.hexdigest()
+    set_updatetime(job["path"], job["updatetime"])
+    return written_size
+
+
+def set_updatetime(path: str, updatetime: str):
+    """
+    ファイルの日時を指定した日時に変更する（カービングで見つけたファイルは日時が分からないため変更しない）
+    """
+    if updatetime:
+        update_datetime = datetime.strptime(updatetime, "%Y-%m-%d %H:%M:%S")
+        os.utime(path=path, times=(update_datetime.timestamp(), update_datetime.timestamp()))
+
+
+def copy_restored(job: dict, restored_path: str) -> int:
+    """
+    同じ内容を復元済みのファイルから、デバイスを読まずに復元する
+    日時も同じならハードリンクを作成し、できない場合（日時が異なる・リンク非対応のファイルシステム）はコピーする
+    戻り値: 書き込んだバイト数
+    """
+    os.makedirs(job["parent_dir"], exist_ok=True)
+    if os.path.lexists(job["path"]):
+        os.remove(job["path"])
+    linked = False
+    if job["updatetime"] == job["copy_updatetime"]:
+        try:
+            os.link(restored_path, job["path"])
+            linked = True
+        except OSError:
+            pass
+    if not linked:
+        shutil.copyfile(restored_path, job["path"])
+        set_updatetime(job["path"], job["updatetime"])
+    return os.path.getsize(job["path"])
+
+
+def file_sha256(path: str, buffer: bytearray | None = None) -> str | None:
+    """
+    ファイルのハッシュ（SHA-256）を返す（ファイルがない場合は None）
+    """
+    if buffer is None:
+        buffer = bytearray(RESTORE_BUFFER_SIZE)
+    view = memoryview(buffer)
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            while read_size := f.readinto(buffer):
+                digest.update(view[:read_size])
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def verify_restored(job: dict, thread_state: threading.local) -> str | None:
+    """
+    前回復元したファイルが出力先に残っていて、記録したハッシュと一致すればそのハッシュを返す（ワーカースレッドで実行）
+    """
+    if not job["known_sha256"] or not os.path.isfile(job["path"]) or os.path.getsize(job["path"]) != job["size"]:
+        return None
+    if not hasattr(thread_state, "buffer"):
+        thread_state.buffer = bytearray(RESTORE_BUFFER_SIZE)
+    digest = file_sha256(job["path"], thread_state.buffer)
+    return digest if digest == job["known_sha256"] else None
+
+
+def build_restore_job(entry: dict, verify_fat: bool = False, free_map: bool = False) -> dict | None:
+    """
+    復元対象のエントリ（パス・ファイル名・先頭クラスタ・サイズ・更新日時）から復元ジョブを作成する
+    free_map: 削除済みファイルのクラスタを、FATのチェーンではなく空きクラスタマップから推定する
+    クラスタチェーンが途中で途切れている場合は None
+    """
+    file_full_path = "\\".join([entry["path"], entry["filename"]])
+    cluster_count = (entry["size"] + CLUSTER_SIZE - 1) // CLUSTER_SIZE
+    if entry.get("origin") == "carve":
+        # カービングで見つけたファイルは、先頭クラスタから連続しているとみなす
+        extents = [(entry["first_cluster"], cluster_count)]
+    elif free_map and entry.get("deleted"):
+        # 削除済みファイルのFATのチェーンは消えているため、先頭クラスタ以降の空きクラスタを順に使っていたとみなす
+        fat = load_fat(SOURCE, verify_fat)
+        if not fat.is_free(entry["first_cluster"]):
+            print(f"⚠ 先頭クラスタが別のファイルで使用されているため、上書きされています: {file_full_path}")
+            return None
+        extents = fat.free_extents(entry["first_cluster"], cluster_count)
+        found_count = sum(count for _, count in extents)
+        if found_count < cluster_count:
+            print(f"⚠ 空きクラスタが足りません（{found_count}/{cluster_count} クラスタ）: {file_full_path}")
+            return None
+        run_stats.count("files_reconstructed")
+    else:
+        # FATキャッシュからクラスタチェーンを取得（ファイルサイズ分のクラスタ数だけ辿る）
+        cluster_chain = load_fat(SOURCE, verify_fat).chain(entry["first_cluster"], cluster_count)
+        if len(cluster_chain) < cluster_count:
+            print(f"⚠ クラスタチェーンが途中で途切れています（{len(cluster_chain)}/{cluster_count} クラスタ）: {file_full_path}")
+            return None
+        extents = cluster_extents(cluster_chain)
+    return {
+        "entry": entry,
+        "path": file_full_path,
+        "parent_dir": entry["path"],
+        "source": SOURCE,
+        # ジョブは後でまとめて実行するため、作成時のボリューム情報を記録しておく（Excelには複数のボリュームの行が混在しうる）
+        "data_start_byte": DATA_START_BYTE,
+        "cluster_size": CLUSTER_SIZE,
+        "size": entry["size"],
+        "updatetime": entry["updatetime"],
+        "extents": extents,
+        # 前回の復元で記録したハッシュ（出力先のファイルと一致すれば復元を省略）
+        "known_sha256": entry.get("sha256"),
+        # 先頭エクステントの物理バイト位置（読み込み順の並べ替えに使用）
+        "offset": DATA_START_BYTE + (extents[0][0] - 2) * CLUSTER_SIZE if extents else 0,
+    }
+
+
+def run_restore_jobs(restore_jobs: List[dict], jobs: int = 1) -> List[dict]:
+    """
+    復元ジョブをデバイス上の位置順に並べ替えて、ワーカースレッドで並列に実行する
+    - 同じ出力先のジョブは最後のものだけを実行する（前のジョブは上書きされるため、最後のジョブと一緒に完了扱い）
+    - 出力先に前回復元したファイルが残っていて、記録したハッシュと一致するものは読み込まない
+    - 同じ内容（同じクラスタ・サイズ、または同じハッシュ）のジョブはデバイスから1回だけ読み込み、残りはハードリンク・コピーで作る
+    戻り値: 復元が完了したジョブのリスト（各ジョブの "sha256" に復元したファイルのハッシュを設定）
+    """
+    # 出力先ごとに最後のジョブだけを残す
+    final_jobs = {}
+    for job in restore_jobs:
+        job["superseded"] = []
+        if job["path"] in final_jobs:
+            previous = final_jobs.pop(job["path"])
+            job["superseded"] = previous["superseded"] + [previous]
+        final_jobs[job["path"]] = job
+
+    completed_jobs = []
+    thread_state = threading.local()
+
+    def complete(job: dict):
+        completed_jobs.append(job)
+        completed_jobs.extend(job["superseded"])
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        # 1. 前回復元したファイルが正しく残っているものは省略する
+        pending_jobs = []
+        # Key: ハッシュ, Value: そのハッシュを持つ復元済みのファイル
+        restored_files = {}
+        for job, digest in zip(final_jobs.values(), executor.map(verify_restored, final_jobs.values(), [thread_state] * len(final_jobs))):
+            if digest is None:
+                pending_jobs.append(job)
+                continue
+            job["sha256"] = digest
+            job["restored"] = True
+            restored_files.setdefault(digest, job)
+            run_stats.count("files_verified")
+            complete(job)
+        if restored_files:
+            print(f"出力先に正しく復元済みの {len(final_jobs) - len(pending_jobs):,} 件のファイルを省略しました。")
+
+        # 2. 同じ内容のジョブをまとめる（物理位置の昇順で最初のジョブだけをデバイスから読み込む）
+        read_jobs = []
+        copy_jobs = []
+        # Key: (読み込み元, データ領域の先頭, クラスタサイズ, エクステント, サイズ), Value: デバイスから読み込むジョブ
+        primary_jobs = {}
+        for job in sorted(pending_jobs, key=lambda job: job["offset"]):
+            key = (job["source"], job["data_start_byte"], job["cluster_size"], tuple(job["extents"]), job["size"])
+            if job["known_sha256"] in restored_files:
+                job["copy_of"] = restored_files[job["known_sha256"]]
+                copy_jobs.append(job)
+            elif key in primary_jobs:
+                job["copy_of"] = primary_jobs[key]
+                copy_jobs.append(job)
+            else:
+                primary_jobs[key] = job
+                read_jobs.append(job)
+
+        # 3. 物理位置の昇順（エレベータ順）に並べて、ワーカーで並列に読み込み・書き込み
+        progress = ProgressReporter(0, sum(job["size"] for job in pending_jobs), "ファイル", show_cluster=False)
+        restored_bytes = 0
+        futures = {executor.submit(restore_job, job, thread_state): job for job in read_jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                outcome = future.result()
+            except Exception as e:
+                print(f"❌ 復元中にエラーが発生しました: {job['path']} ({e})")
+                run_stats.count("restore_failed")
+                continue
+            if outcome < job["size"]:
+                print(f"⚠ デバイスの終端に達したため、{outcome}/{job['size']} バイトのみ復元しました: {job['path']}")
+            job["restored"] = True
+            complete(job)
+            restored_bytes += job["size"]
+            run_stats.count("files_restored")
+            run_stats.count("bytes_restored", outcome)
+            if VERBOSE:
+                print(f"ファイルを保存しました: {job['path']}")
+            progress.advance(restored_bytes, 1)
+
+        # 4. 同じ内容のジョブは、復元済みのファイルからハードリンク・コピーで作る（元の復元が失敗した場合はデバイスから読み込む）
+        futures = {}
+        for job in copy_jobs:
+            original = job["copy_of"]
+            if original.get("restored"):
+                job["copy_updatetime"] = original["updatetime"]
+                futures[executor.submit(copy_restored, job, original["path"])] = job
+            else:
+                futures[executor.submit(restore_job, job, thread_state)] = job
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                outcome = future.result()
+            except Exception as e:
+                print(f"❌ 復元中にエラーが発生しました: {job['path']} ({e})")
+                run_stats.count("restore_failed")
+                continue
+            if "sha256" not in job:
+                # 元のファイルからコピーした
+                job["sha256"] = job["copy_of"]["sha256"]
+                run_stats.count("files_deduplicated")
+            else:
+                run_stats.count("files_restored")
+                run_stats.count("bytes_restored", outcome)
+            complete(job)
+            restored_bytes += job["size"]
+            if VERBOSE:
+                print(f"ファイルを保存しました: {job['path']}")
+            progress.advance(restored_bytes, 1)
+    progress.finish()
+    for volume in volumes.values():
+        if volume.cache is not None:
+            print(f"{volume.source}: {volume.cache.summary()}")
+    return completed_jobs
+
+
+def salvage_file(excel_file_path: str, verify_fat: bool = False, jobs: int = 1, source: str | None = None, free_map: bool = False):
+    global DATA_START_BYTE, CLUSTER_SIZE, RESERVED_SECTORS, BYTES_PER_SECTOR, FATSize, SOURCE
+    """
+    Excelファイルの「復旧チェック」列を見て、「1」の時、復旧する（スキャン結果ストアがない場合）
     excel_file_path: エクセルファイル名
+    verify_fat: FAT2（ミラー）との食い違いをチェックするか
+    jobs: 並列に実行する復元ジョブ数
+    source: 読み込み元（指定時はR列より優先。R列のない古いファイルでは必須）
+    free_map: 削除済みファイルのクラスタを空きクラスタマップから推定する
     """
     wb = openpyxl.load_workbook(excel_file_path)
     ws = wb.active
 
+    # 1. 復元対象の行を集めて、復元ジョブを作成
+    restore_jobs = []
+    # Key: R列の読み込み元, Value: 復元に使う読み込み元
+    resolved_sources = {}
     for row in ws.iter_rows(min_row=2):
-        file_full_path = "\\".join([row[10].value, row[3].value])
-        parent_dir = row[10].value
-        file_name = row[3].value
-        
         if row[0].value != 1: # 復元対象外
             continue
 
         # 復元対象
-        first_cluster = int(row[8].value)
-        file_size = int(row[5].value)
         CLUSTER_SIZE = int(row[14].value)
         RESERVED_SECTORS = int(row[11].value)
         BYTES_PER_SECTOR = int(row[12].value)
+        FATSize = int(row[13].value)
         DATA_START_BYTE = int(row[15].value)
-        # 親ディレクトリを作成
-        os.makedirs(parent_dir, exist_ok=True)
-        
-        file_size_rest = file_size
-        cluster_chain = [first_cluster]
-        current_cluster = first_cluster
-        while file_size_rest > 0:
-            current_cluster = get_next_cluster("D", current_cluster)
-            cluster_chain.append(current_cluster)
-            file_size_rest -= CLUSTER_SIZE
-        # 最後の要素は削除
-        cluster_chain.pop()
-        # print(f"cluster chain: {cluster_chain}")
-        
-        file_size_rest = file_size
-        file_data = b""
-        for cluster in cluster_chain: # クラスタチェーンをたどって、１クラスタずつ読む
-            file_data += get_file("D", cluster, file_size_rest if file_size_rest < CLUSTER_SIZE else CLUSTER_SIZE)
-            file_size_rest -= CLUSTER_SIZE
-        with open(file_full_path, "wb") as out_f:
-            out_f.write(file_data)
-
-        # 指定した日時に変更する
-        update_datetime = datetime.strptime(row[7].value, "%Y-%m-%d %H:%M:%S")
-        os.utime(path=file_full_path, times=(update_datetime.timestamp(), update_datetime.timestamp()))
-        # 復旧チェック列を「０」にする
+        stored_source = row[SOURCE_COLUMN].value if len(row) > SOURCE_COLUMN else None
+        if stored_source not in resolved_sources:
+            resolved_sources[stored_source] = override_source(stored_source, source)
+        SOURCE = resolved_sources[stored_source]
+        if not SOURCE:
+            print(f"⚠ 読み込み元が分からないためスキップします（--target_drive で指定してね）: {row[3].value}")
+            continue
+        job = build_restore_job({
+            "path": row[10].value,
+            "filename": row[3].value,
+            "first_cluster": int(row[8].value),
+            "size": int(row[5].value),
+            "updatetime": row[7].value or "",
+            "deleted": row[9].value == "!",
+            "origin": row[ORIGIN_COLUMN].value if len(row) > ORIGIN_COLUMN else "entry",
+            "sha256": row[SHA256_COLUMN].value if len(row) > SHA256_COLUMN else None,
+            "row": row,
+        }, verify_fat, free_map)
+        if job is not None:
+            restore_jobs.append(job)
+
+    # 2. 並列に復元し、完了した行の復旧チェック列を「０」にしてハッシュを記録する（ワークシートの更新はメインスレッドのみで行う）
+    if restore_jobs:
+        ws.cell(row=1, column=SHA256_COLUMN + 1, value="SHA-256")
+    for job in run_restore_jobs(restore_jobs, jobs):
+        row = job["entry"]["row"]
         row[0].value = 0
-        print(f"ファイルを保存しました: {file_full_path}")
+        if job.get("sha256"):
+            ws.cell(row=row[0].row, column=SHA256_COLUMN + 1, value=job["sha256"])
 
     # 3. ファイルの保存
     try:
@@ -157,6 +1226,280 @@ def salvage_file(excel_file_path: str):
         print(f"\n❌ ファイル保存中にエラーが発生しました: {e}")
 
 
+def open_store(db_file: str) -> sqlite3.Connection:
+    """
+    スキャン結果ストア（SQLite）を開く（テーブル・インデックスがなければ作成する）
+    """
+    conn = sqlite3.connect(db_file)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(STORE_SCHEMA)
+    # 後から追加した列がない古いストアには追加する
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(entries)")}
+    for column, definition in STORE_MIGRATIONS.items():
+        if column not in columns:
+            conn.execute(f"ALTER TABLE entries ADD COLUMN {column} {definition}")
+    return conn
+
+
+def store_row(entry: dict) -> tuple:
+    """
+    スキャン結果1件を entries テーブルへの INSERT 用のタプルに変換する
+    """
+    return (
+        entry["current_byte"],
+        entry["current_cluster"],
+        entry["filename"],
+        entry["filetype"],
+        entry["size"],
+        entry["attribute"],
+        entry["updatetime"],
+        entry["first_cluster"],
+        int(entry["deleted"]),
+        entry.get("path", ""),
+        entry.get("origin", "entry"),
+    )
+
+
+def save_to_store(results: Iterable[dict], db_file: str):
+    """
+    スキャン結果とボリューム情報をストアに保存する（以前の結果とチェックポイントは置き換える）
+    """
+    conn = open_store(db_file)
+    with conn:
+        conn.execute("DELETE FROM entries")
+        conn.execute("DELETE FROM scan_checkpoint")
+        conn.execute("DELETE FROM volume")
+        conn.executemany("INSERT INTO volume (key, value) VALUES (?, ?)", volume_rows())
+        conn.executemany(STORE_INSERT, (store_row(entry) for entry in results))
+        count = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+    conn.close()
+    print(f"\n✅ スキャン結果 {count:,} 件をストアに保存しました: {db_file}")
+
+
+def load_store_geometry(conn: sqlite3.Connection):
+    """
+    ストアに保存したボリューム情報をグローバル変数に設定する
+    """
+    set_geometry({row["key"]: row["value"] for row in conn.execute("SELECT key, value FROM volume WHERE key != ?", (SCAN_ID_KEY,))})
+
+
+def volume_rows() -> list:
+    """
+    新しいスキャンでストアの volume テーブルに保存する行（ボリューム情報と、スキャンの識別子）
+    """
+    return [*current_geometry().items(), (SCAN_ID_KEY, uuid.uuid4().hex)]
+
+
+def store_scan_id(conn: sqlite3.Connection) -> str | None:
+    """
+    ストアに保存したスキャンの識別子を返す（識別子を保存していない古いストアでは None）
+    """
+    row = conn.execute("SELECT value FROM volume WHERE key = ?", (SCAN_ID_KEY,)).fetchone()
+    return row["value"] if row else None
+
+
+def iter_store_entries(conn: sqlite3.Connection, where: str = "", params: Iterable = ()):
+    """
+    ストアのエントリをID順に辞書として返すジェネレータ
+    """
+    for row in conn.execute(f"SELECT * FROM entries {where} ORDER BY id", tuple(params)):
+        entry = dict(row)
+        entry["deleted"] = bool(entry["deleted"])
+        yield entry
+
+
+class ScanCheckpoint:
+    """
+    スイープの進捗（次に読むバイト位置・未消費のLFNエントリ・途中までのスキャン結果）をスキャン結果ストアに定期的に保存する
+    中断後は --resume で最後のチェックポイントから再開できる
+    """
+
+    def __init__(self, db_file: str, resume: bool = False):
+        self.conn = open_store(db_file)
+        self.next_byte = DATA_START_BYTE
+        self.lfn_buffer = []
+        if resume:
+            self._load()
+        else:
+            # 新しいスキャンを開始（以前の結果とチェックポイントは破棄）
+            with self.conn:
+                self.conn.execute("DELETE FROM entries")
+                self.conn.execute("DELETE FROM scan_checkpoint")
+                self.conn.execute("DELETE FROM volume")
+                self.conn.executemany("INSERT INTO volume (key, value) VALUES (?, ?)", volume_rows())
+        self.saved_byte = self.next_byte
+        # 最後にブロックを処理し終えた時点の状態（次に読むバイト位置, LFNエントリ, その時点の結果件数）
+        self.pending = (self.next_byte, [dict(part) for part in self.lfn_buffer], 0)
+
+    def _load(self):
+        row = self.conn.execute("SELECT next_byte, lfn_buffer FROM scan_checkpoint").fetchone()
+        if row is None:
+            raise ValueError("再開できるチェックポイントがありません。")
+        stored_geometry = {volume["key"]: volume["value"] for volume in self.conn.execute("SELECT key, value FROM volume WHERE key != ?", (SCAN_ID_KEY,))}
+        if stored_geometry != current_geometry():
+            raise ValueError("チェックポイントのボリューム情報が現在のドライブと一致しません。")
+        self.next_byte = row["next_byte"]
+        self.lfn_buffer = [
+            {"seq": part["seq"], "bytes": bytes.fromhex(part["bytes"]), "checksum": part["checksum"]}
+            for part in json.loads(row["lfn_buffer"])
+        ]
+        stored_count = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        print(f"チェックポイントから再開します: {self.next_byte:,} バイト目（保存済みの結果 {stored_count:,} 件）")
+
+    def block_done(self, next_byte: int, lfn_buffer: list, scan_results: list):
+        """
+        ブロックを処理し終えるたびに呼び出す。前回の保存から CHECKPOINT_INTERVAL バイト進んでいれば保存する
+        """
+        self.pending = (next_byte, [dict(part) for part in lfn_buffer], len(scan_results))
+        if next_byte - self.saved_byte >= CHECKPOINT_INTERVAL:
+            self.save(scan_results)
+
+    def save(self, scan_results: list):
+        """
+        最後に処理し終えたブロックまでの結果と進捗を1つのトランザクションで保存し、保存した結果はメモリから解放する
+        """
+        next_byte, lfn_buffer, count = self.pending
+        with self.conn:
+            self.conn.executemany(STORE_INSERT, (store_row(entry) for entry in scan_results[:count]))
+            self.conn.execute("DELETE FROM scan_checkpoint")
+            self.conn.execute(
+                "INSERT INTO scan_checkpoint (next_byte, lfn_buffer) VALUES (?, ?)",
+                (next_byte, json.dumps([{"seq": part["seq"], "bytes": part["bytes"].hex(), "checksum": part["checksum"]} for part in lfn_buffer])),
+            )
+        del scan_results[:count]
+        self.pending = (next_byte, lfn_buffer, 0)
+        self.saved_byte = next_byte
+
+    def finish(self, scan_results: list) -> list:
+        """
+        残りの結果を保存し、これまでのセッション分も含めた全スキャン結果を返す
+        """
+        self.save(scan_results)
+        all_results = list(iter_store_entries(self.conn))
+        self.conn.close()
+        return all_results
+
+
+def scan_with_checkpoints(volume: Volume, db_file: str, scan_filter: ScanFilter, prefilter: bool = False, scan_stats: dict | None = None, resume: bool = False, carve: bool = False) -> list | None:
+    """
+    チェックポイントを保存しながらデータ領域全体を逐次スキャンする
+    中断（Ctrl-C）された場合は None を返す（読み込みエラーなどの例外は、チェックポイントを保存してから再送出する）
+    """
+    checkpoint = ScanCheckpoint(db_file, resume)
+    lfn_buffer = checkpoint.lfn_buffer
+    scan_results = []
+    progress = ProgressReporter(checkpoint.next_byte, TOTAL_SECTORS * BYTES_PER_SECTOR)
+    try:
+        scan_range(
+            volume, checkpoint.next_byte, None, lfn_buffer, scan_filter, scan_results, prefilter, scan_stats,
+            on_block=lambda next_byte: checkpoint.block_done(next_byte, lfn_buffer, scan_results),
+            progress=progress,
+            carve=carve,
+        )
+    except BaseException as e:
+        progress.finish()
+        checkpoint.save(scan_results)
+        print(f"\n⏸ {checkpoint.saved_byte:,} バイト目までの進捗を保存しました。--resume で再開できます。")
+        if isinstance(e, KeyboardInterrupt):
+            return None
+        raise
+    return checkpoint.finish(scan_results)
+
+
+def select_entries(db_file: str, ids: List[int] | None = None, extensions: List[str] | None = None, deleted_only: bool = False) -> int:
+    """
+    条件（ID・拡張子・削除済みのみ）に一致するエントリを復元対象にする
+    前回までの選択（復元できずに残った復元対象を含む）は解除し、今回の条件に一致するものだけを復元対象にする
+    戻り値: 復元対象にしたエントリ数
+    """
+    conditions = []
+    params = []
+    if ids:
+        conditions.append(f"id IN ({','.join('?' * len(ids))})")
+        params.extend(ids)
+    if extensions:
+        conditions.append(f"filetype IN ({','.join('?' * len(extensions))})")
+        params.extend(extensions)
+    if deleted_only:
+        conditions.append("deleted = 1")
+    # ファイルのみが復元対象
+    conditions.append("attribute = '0x20'")
+    conn = open_store(db_file)
+    with conn:
+        conn.execute("UPDATE entries SET restore_flag = NULL WHERE restore_flag = 1")
+        count = conn.execute(f"UPDATE entries SET restore_flag = 1 WHERE {' AND '.join(conditions)}", params).rowcount
+    conn.close()
+    print(f"{count:,} 件のエントリを復元対象にしました。")
+    return count
+
+
+def import_excel_selection(db_file: str, excel_file_path: str) -> int:
+    """
+    Excelファイルの「復旧チェック」列（ID列で対応付け）をストアに取り込む
+    戻り値: 復元対象になったエントリ数
+    """
+    wb = openpyxl.load_workbook(excel_file_path, read_only=True)
+    conn = open_store(db_file)
+    scan_id = store_scan_id(conn)
+    if (wb.properties.identifier or None) != scan_id:
+        # ID列は別のスキャンの結果と対応しないため、取り込むと無関係なエントリを復元対象にしてしまう
+        wb.close()
+        conn.close()
+        print(f"⚠ {excel_file_path} はスキャン結果ストア {db_file} から書き出したものではないため、復旧チェックを取り込みません。")
+        return 0
+    ws = wb.active
+    selection = [
+        (row[0] if row[0] in (0, 1) else None, row[STORE_ID_COLUMN])
+        for row in ws.iter_rows(min_row=2, values_only=True)
+        if len(row) > STORE_ID_COLUMN and row[STORE_ID_COLUMN] is not None
+    ]
+    wb.close()
+    with conn:
+        conn.executemany("UPDATE entries SET restore_flag = ? WHERE id = ?", selection)
+    conn.close()
+    return sum(1 for flag, entry_id in selection if flag == 1)
+
+
+def export_excel(db_file: str, excel_file_path: str):
+    """
+    ストアの内容をExcelファイル（A～P列は従来と同じレイアウト）に書き出す
+    """
+    conn = open_store(db_file)
+    load_store_geometry(conn)
+    save_to_excel(iter_store_entries(conn), excel_file_path, store_scan_id(conn))
+    conn.close()
+
+
+def salvage_from_store(db_file: str, verify_fat: bool = False, jobs: int = 1, source: str | None = None, free_map: bool = False):
+    """
+    ストアで復元対象になっているエントリを復元し、完了したものは復旧チェックを「0」（復元済み）にする
+    source: 読み込み元（指定時はスキャン時の読み込み元より優先）
+    free_map: 削除済みファイルのクラスタを空きクラスタマップから推定する
+    """
+    conn = open_store(db_file)
+    load_store_geometry(conn)
+    if source:
+        set_geometry({"SOURCE": override_source(SOURCE, source)})
+    if not SOURCE:
+        conn.close()
+        print("❌ 読み込み元が分かりません。--target_drive で指定してね。")
+        return
+    selected_entries = list(iter_store_entries(conn, "WHERE restore_flag = 1"))
+    restore_jobs = [job for job in (build_restore_job(entry, verify_fat, free_map) for entry in selected_entries) if job is not None]
+    completed_jobs = run_restore_jobs(restore_jobs, jobs)
+    with conn:
+        conn.executemany(
+            "UPDATE entries SET restore_flag = 0, sha256 = COALESCE(?, sha256) WHERE id = ?",
+            [(job.get("sha256"), job["entry"]["id"]) for job in completed_jobs],
+        )
+    conn.close()
+    print(f"\n✅ {len(completed_jobs):,}/{len(selected_entries):,} 件のファイルを復元しました。")
+    skipped_count = len(selected_entries) - len(restore_jobs)
+    if skipped_count:
+        # 復元対象のまま残す（--free-map などで再度試せる。次に条件で選択し直すと解除される）
+        print(f"⚠ {skipped_count:,} 件はクラスタを辿れないためスキップしました。")
+
+
 # 辞書を作成
 # parent_map = create_parent_lookup("fat32_scan_results.xlsx")
 def sanitize_string(value: str, invalid_codepoints: Iterable[int] | None = None) -> str:
@@ -177,23 +1520,31 @@ def sanitize_string(value: str, invalid_codepoints: Iterable[int] | None = None)
     translation_table = {ord(ch): None for ch in invalid_chars}
     return value.translate(translation_table)
 
-def save_to_excel(results: list, output_filename: str = "fat32_scan_results.xlsx"):
-
-    # 新しいワークブックを作成
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "復旧可能エントリリスト"
+def save_to_excel(results: Iterable[dict], output_filename: str = "fat32_scan_results.xlsx", scan_id: str | None = None):
+    """
+    スキャン結果をExcelファイルに書き出す
+    書き込み専用モードで results（ジェネレータ可）から1行ずつ書き出すため、件数によらずメモリ使用量は一定
+    scan_id: ストアのスキャンの識別子（ブックのプロパティに記録し、復旧チェックの取り込み時に照合する）
+    """
+    # 書き込み専用のワークブックを作成
+    wb = openpyxl.Workbook(write_only=True)
+    wb.properties.identifier = scan_id
+    ws = wb.create_sheet(title="復旧可能エントリリスト")
+    # 数値列の書式は列単位で設定し、各セルは同じ書式を共有する
+    for column in "BCFILMNOP":
+        ws.column_dimensions[column].number_format = '#,##0'
+    number_columns = {1, 2, 5, 8, 11, 12, 13, 14, 15}
     
     # 1. ヘッダー行の書き込み
-    headers = ["復旧チェック", "バイト位置", "クラスタ位置", "ファイル名", "ファイルタイプ", "ファイルサイズ (B)", "属性", "最終更新日時", "先頭クラスタ", "削除フラグ", "場所", "RESERVED_SECTORS", "BYTES_PER_SECTOR", "FATSize", "CLUSTER_SIZE", "DATA_START_BYTE"]
-    #           A               B             C               D             E                 F                     G       H               I               J             K       L                   M                   N          O               P
+    headers = ["復旧チェック", "バイト位置", "クラスタ位置", "ファイル名", "ファイルタイプ", "ファイルサイズ (B)", "属性", "最終更新日時", "先頭クラスタ", "削除フラグ", "場所", "RESERVED_SECTORS", "BYTES_PER_SECTOR", "FATSize", "CLUSTER_SIZE", "DATA_START_BYTE", "ID", "SOURCE", "検出方法", "SHA-256"]
+    #           A               B             C               D             E                 F                     G       H               I               J             K       L                   M                   N          O               P                  Q     R         S           T
     ws.append(headers)
     
     # 2. データ行の書き込み
     for entry in results:
         # Excelの1行に書き込むデータ
         row_data = [
-            "",
+            "" if entry.get("restore_flag") is None else entry["restore_flag"], # 復旧チェック（1: 復元対象, 0: 復元済み）
             entry["current_byte"],
             entry["current_cluster"],
             entry["filename"],                   # ファイル名 (LFN または SFN)
@@ -203,23 +1554,18 @@ def save_to_excel(results: list, output_filename: str = "fat32_scan_results.xlsx
             entry["updatetime"],                    # 日時情報 (文字列または datetime オブジェクト)
             entry["first_cluster"],                    # 先頭クラスタ番号
             "!" if entry["deleted"] else "", # 削除フラグ
-            "", # 場所（２周目で算出）
+            entry.get("path", ""), # 場所（ツリー巡回時は判明済み、それ以外は２周目で算出）
             RESERVED_SECTORS,
             BYTES_PER_SECTOR,
             FATSize,
             CLUSTER_SIZE,
-            DATA_START_BYTE
+            DATA_START_BYTE,
+            entry.get("id", ""), # ストアのID（復旧チェックの取り込みに使用）
+            SOURCE, # 読み込み元（復元時に使用）
+            entry.get("origin", "entry"), # 検出方法（entry: ディレクトリエントリ, carve: カービング）
+            entry.get("sha256") or "", # 復元したファイルのハッシュ（次回の復元で一致すれば読み込みを省略）
         ]
-        ws.append(row_data)
-        ws[f'B{ws.max_row}'].number_format = '#,##0'
-        ws[f'C{ws.max_row}'].number_format = '#,##0'
-        ws[f'F{ws.max_row}'].number_format = '#,##0'
-        ws[f'I{ws.max_row}'].number_format = '#,##0'
-        ws[f'L{ws.max_row}'].number_format = '#,##0'
-        ws[f'M{ws.max_row}'].number_format = '#,##0'
-        ws[f'N{ws.max_row}'].number_format = '#,##0'
-        ws[f'O{ws.max_row}'].number_format = '#,##0'
-        ws[f'P{ws.max_row}'].number_format = '#,##0'
+        ws.append([number_cell(ws, value) if index in number_columns else value for index, value in enumerate(row_data)])
         
     # 3. ファイルの保存
     try:
@@ -228,12 +1574,20 @@ def save_to_excel(results: list, output_filename: str = "fat32_scan_results.xlsx
     except Exception as e:
         print(f"\n❌ ファイル保存中にエラーが発生しました: {e}")
 
-def get_file(drive_letter: str, first_cluster: int, file_size: int) -> bytes:
+
+def number_cell(ws, value) -> WriteOnlyCell:
+    """
+    桁区切り書式 (#,##0) の書き込み専用セルを作成する
+    """
+    cell = WriteOnlyCell(ws, value)
+    cell.number_format = '#,##0'
+    return cell
+
+def get_file(source: str, first_cluster: int, file_size: int) -> bytes:
     global DATA_START_BYTE
     """
     FAT32のクラスタ番号からファイルデータを読み込む関数
     """
-    drive_path = f"\\\\.\\{drive_letter}:"
     if first_cluster < 2:
         # クラスタ0と1は予約済み
         raise ValueError(
@@ -243,290 +1597,1223 @@ def get_file(drive_letter: str, first_cluster: int, file_size: int) -> bytes:
     # クラスタ2がデータ領域の先頭（オフセット0）に対応する
     offset = DATA_START_BYTE + (first_cluster - 2) * CLUSTER_SIZE
 
-    with open(drive_path, "rb") as f:
-        f.seek(offset)
-        return f.read(file_size)
+    return bytes(open_volume(source).read(offset, file_size))
 
-def get_next_cluster(drive_letter: str, cluster_number: int) -> int:
-    global RESERVED_SECTORS, BYTES_PER_SECTOR
+class FatCache:
     """
-    次のクラスタ番号を返す関数
+    FAT領域を一度だけ読み込み、クラスタチェーンをメモリ上で辿るためのキャッシュ
+    FATの各エントリは array('I') に格納する（1クラスタあたり4バイト）
     """
-    # Windowsでは「\\.\」を前につけて特殊なデバイスとして扱う必要があるわ。
-    drive_path = f"\\\\.\\{drive_letter}:"
-    if cluster_number < 2:
-        # クラスタ0と1は予約済み
-        raise ValueError(
-            "無効なクラスタ番号です。クラスタ番号は2以上である必要があります。"
-        )
 
-    with open(drive_path, "rb") as f:
-        # 読み込むデータサイズ (1MB = 1024 * 1024 バイト)
-        # raw_data = f.read(READ_SIZE)
-        # offset = RESERVED_SECTORS * BYTES_PER_SECTOR + cluster_number * 4
-        # READ_SIZE = RESERVED_SECTORS * BYTES_PER_SECTOR - 512
-        offset = RESERVED_SECTORS * BYTES_PER_SECTOR - 1024
-        f.seek(offset)
-        f.read(1024)
-        # f.read(512 + cluster_number * 4)
-        f.read(cluster_number * 4)
-        next_cluster = unpack("<I", f.read(4))[0]
-        # 6. FAT32の予約ビットをクリア (上位4ビットを無視)
-        next_cluster &= FAT32_CLUSTER_MASK
-        return next_cluster
-
-
-def read_raw_data(drive_letter: str, target_exts: List[str], xlsx_file: str):
-    # Windowsでは「\\.\」を前につけて特殊なデバイスとして扱う必要があるわ。
-    drive_path = f"\\\\.\\{drive_letter}:"
-    # 読み込むデータサイズ (1MB = 1024 * 1024 バイト)
-    READ_SIZE = 1024 * 1024
-    # 復元対象としたい属性のマスク
-    VALID_ATTRIBUTES = 0x08 | 0x10 | 0x20  # 0x08(V) or 0x10(D) or 0x20(A)
-    
+    def __init__(self, volume: Volume, reserved_sectors: int, bytes_per_sector: int, fat_size: int, fat_count: int = 1, verify_mirror: bool = False, cluster_limit: int | None = None):
+        fat_offset = reserved_sectors * bytes_per_sector
+        fat_bytes = fat_size * bytes_per_sector
+        # FAT2と食い違っているクラスタ番号（verify_mirror 指定時のみ）
+        self.mismatches = []
+
+        self.entries = self._to_array(volume.read(fat_offset, fat_bytes))
+        # データ領域に実在するクラスタ番号の上限（FATの末尾の余りは空きクラスタとして扱わない）
+        self.cluster_limit = min(cluster_limit or len(self.entries), len(self.entries))
+        # 空きクラスタマップ（free_map() の初回呼び出し時に作成）
+        self._free_map = None
+        if verify_mirror and fat_count > 1:
+            # 2番目のFAT（ミラー）と突き合わせる
+            mirror = self._to_array(volume.read(fat_offset + fat_bytes, fat_bytes))
+            self.mismatches = [
+                cluster_number
+                for cluster_number, (primary, secondary) in enumerate(zip(self.entries, mirror))
+                if (primary ^ secondary) & FAT32_CLUSTER_MASK
+            ]
+
+    @staticmethod
+    def _to_array(raw: memoryview) -> array:
+        entries = array("I")
+        entries.frombytes(raw[:len(raw) - len(raw) % entries.itemsize])
+        # FATはリトルエンディアン
+        if sys.byteorder == "big":
+            entries.byteswap()
+        return entries
+
+    def next_cluster(self, cluster_number: int) -> int:
+        """
+        次のクラスタ番号を返す
+        """
+        if cluster_number < 2 or cluster_number >= len(self.entries):
+            # クラスタ0と1は予約済み
+            raise ValueError(
+                "無効なクラスタ番号です。クラスタ番号は2以上である必要があります。"
+            )
+        # FAT32の予約ビットをクリア (上位4ビットを無視)
+        return self.entries[cluster_number] & FAT32_CLUSTER_MASK
+
+    def chain(self, first_cluster: int, max_length: int | None = None) -> List[int]:
+        """
+        先頭クラスタからクラスタチェーンを辿ってリストで返す
+        終端 (EOC)・未使用・不良クラスタ・範囲外・ループを検出した時点で打ち切る
+        max_length: 取得する最大クラスタ数（ファイルサイズから求めた数など）
+        """
+        if max_length is None:
+            max_length = len(self.entries)
+        cluster_chain = []
+        visited = set()
+        current_cluster = first_cluster
+        while len(cluster_chain) < max_length:
+            if current_cluster < 2 or current_cluster >= len(self.entries) or current_cluster in visited:
+                break
+            cluster_chain.append(current_cluster)
+            visited.add(current_cluster)
+            current_cluster = self.entries[current_cluster] & FAT32_CLUSTER_MASK
+            if current_cluster >= FAT32_BAD_CLUSTER:
+                # 不良クラスタ (0x0FFFFFF7) or 終端 (0x0FFFFFF8～)
+                break
+        return cluster_chain
+
+    def free_map(self) -> bytes:
+        """
+        空きクラスタマップを返す（初回のみFATから作成）
+        クラスタ番号の位置のバイトが 0: 空き, 1: 使用中（クラスタ0と1、範囲外は含まない）
+        """
+        if self._free_map is None:
+            free_map = bytearray(0 if entry & FAT32_CLUSTER_MASK == 0 else 1 for entry in self.entries[:self.cluster_limit])
+            free_map[:2] = b"\x01" * len(free_map[:2])
+            self._free_map = bytes(free_map)
+        return self._free_map
+
+    def is_free(self, cluster_number: int) -> bool:
+        """
+        空きクラスタかどうかを返す
+        """
+        return 2 <= cluster_number < self.cluster_limit and self.free_map()[cluster_number] == 0
+
+    def free_extents(self, first_cluster: int, cluster_count: int) -> List[Tuple[int, int]]:
+        """
+        削除済みファイル（FATのチェーンが消えている）のクラスタを推定する
+        先頭クラスタから順に、使用中のクラスタを飛ばして空きクラスタを cluster_count 個たどり、
+        連続したクラスタのまとまり (先頭クラスタ, クラスタ数) のリストで返す（空きクラスタが足りない場合は見つかった分だけ）
+        """
+        free_map = self.free_map()
+        extents = []
+        cluster = first_cluster
+        while cluster_count > 0 and cluster != -1:
+            # 空きクラスタが連続する範囲をまとめて取る
+            run_end = free_map.find(b"\x01", cluster)
+            if run_end == -1:
+                run_end = len(free_map)
+            run_length = min(run_end - cluster, cluster_count)
+            extents.append((cluster, run_length))
+            cluster_count -= run_length
+            cluster = free_map.find(b"\x00", run_end)
+        return extents
+
+
+# 読み込み元ごとのFATキャッシュ
+fat_caches = {}
+
+
+def load_fat(source: str, verify_mirror: bool = False) -> FatCache:
+    """
+    現在のジオメトリ（グローバル変数）に対応するFATキャッシュを返す（初回のみデバイスから読み込む）
+    """
+    key = (source, RESERVED_SECTORS, BYTES_PER_SECTOR, FATSize)
+    if key not in fat_caches:
+        fat_count = (DATA_START_BYTE // BYTES_PER_SECTOR - RESERVED_SECTORS) // FATSize if FATSize else 1
+        volume = open_volume(source)
+        # 実在するクラスタ番号の上限（ボリューム情報がない古いExcelからの復元では、読み込み元のサイズから求める）
+        if TOTAL_CLUSTERS:
+            cluster_limit = TOTAL_CLUSTERS + 2
+        elif volume.size > DATA_START_BYTE:
+            cluster_limit = (volume.size - DATA_START_BYTE) // CLUSTER_SIZE + 2
+        else:
+            cluster_limit = None
+        fat_caches[key] = FatCache(volume, RESERVED_SECTORS, BYTES_PER_SECTOR, FATSize, fat_count, verify_mirror, cluster_limit)
+        if verify_mirror and fat_caches[key].mismatches:
+            print(f"⚠ FAT1とFAT2で {len(fat_caches[key].mismatches)} 件のエントリが食い違っています。")
+    return fat_caches[key]
+
+
+def cluster_extents(cluster_chain: List[int]) -> List[Tuple[int, int]]:
+    """
+    クラスタチェーンを、連続したクラスタのまとまり (先頭クラスタ, クラスタ数) のリストに変換する
+    """
+    extents = []
+    for cluster in cluster_chain:
+        if extents and extents[-1][0] + extents[-1][1] == cluster:
+            extents[-1] = (extents[-1][0], extents[-1][1] + 1)
+        else:
+            extents.append((cluster, 1))
+    return extents
+
+
+def restore_extents(source: str, extents: List[Tuple[int, int]], file_size: int, output_path: str, buffer: bytearray | None = None, digest=None, data_start_byte: int | None = None, cluster_size: int | None = None) -> int:
+    """
+    エクステントごとに位置を指定してまとめて読み込み、出力ファイルへそのまま書き出す
+    読み込みには固定サイズのバッファを使い回す（mmap 時はマッピングから直接書き出す）ため、ファイルサイズに関係なくメモリ使用量は一定
+    digest: 書き込むデータでハッシュを更新する（hashlib のオブジェクト）
+    data_start_byte, cluster_size: 読み込み元のボリューム情報（省略時はグローバル変数）
+    戻り値: 書き込んだバイト数
+    """
+    if data_start_byte is None:
+        data_start_byte = DATA_START_BYTE
+    if cluster_size is None:
+        cluster_size = CLUSTER_SIZE
+    volume = open_volume(source)
+    if buffer is None:
+        buffer = bytearray(RESTORE_BUFFER_SIZE)
+    view = memoryview(buffer)
+    file_size_rest = file_size
+
+    with open(output_path, "wb") as out_f:
+        for start_cluster, cluster_count in extents:
+            if file_size_rest <= 0:
+                break
+            # クラスタ2がデータ領域の先頭（オフセット0）に対応する
+            position = data_start_byte + (start_cluster - 2) * cluster_size
+            # デバイスからはクラスタ単位（セクタ境界）で読み、必要な分だけ書き込む
+            extent_rest = cluster_count * cluster_size
+            while extent_rest > 0 and file_size_rest > 0:
+                data = volume.read(position, min(extent_rest, len(buffer)), view)
+                read_size = len(data)
+                if not read_size:
+                    # デバイスの終端
+                    return file_size - file_size_rest
+                write_size = min(read_size, file_size_rest)
+                out_f.write(data[:write_size])
+                if digest is not None:
+                    digest.update(data[:write_size])
+                position += read_size
+                extent_rest -= read_size
+                file_size_rest -= write_size
+    return file_size - file_size_rest
+
+
+def get_next_cluster(source: str, cluster_number: int) -> int:
+    """
+    次のクラスタ番号を返す関数（FATキャッシュを参照する）
+    """
+    return load_fat(source).next_cluster(cluster_number)
+
+
+def _build_attribute_classes() -> bytes:
+    """
+    属性バイト → 分類文字 の変換テーブルを作成する（bytes.translate 用）
+    """
+    table = bytearray(b"." * 256)
+    for attribute_byte in range(256):
+        if (attribute_byte & 0x0F) == 0x0F:
+            table[attribute_byte] = ord("L")
+    table[0x00] = ord("Z")
+    table[0x10] = ord("E")
+    table[0x20] = ord("E")
+    return bytes(table)
+
+
+# 属性バイトの分類（L: LFN, E: ファイル/ディレクトリ候補, Z: 未使用, .: 対象外）
+ATTRIBUTE_CLASSES = _build_attribute_classes()
+# Python側で解析する候補スロット（LFN or ファイル/ディレクトリ）
+CANDIDATE_PATTERN = re.compile(rb"[LE]")
+# LFNバッファをリセットしうるスロット（未使用 or ファイル/ディレクトリ候補）
+RESET_PATTERN = re.compile(rb"[ZE]")
+# ファイル/ディレクトリ候補のスロット
+ENTRY_PATTERN = re.compile(rb"E")
+# ディレクトリエントリとしてありうる属性バイト（予約ビット 0x40, 0x80 が立っていないもの）
+DIRECTORY_ATTRIBUTES = bytes(range(0x40))
+# サブディレクトリ先頭の「.」エントリの名前
+DOT_ENTRY_NAME = b".          "
+# 短いファイル名エントリのレイアウト（名前, 拡張子, 属性, 先頭クラスタ上位, 更新時刻, 更新日, 先頭クラスタ下位, サイズ）
+SFN_ENTRY = Struct("<8s3sB8xHHHHI")
+# 印字可能なASCII（拡張子がこれだけなら、デコードせずに比較できる）
+PRINTABLE_ASCII = bytes(range(0x20, 0x7F))
+# LFNの末尾が「.pages」かどうかを、デコードせずに調べるためのバイト列
+PAGES_SUFFIX_UTF16 = ".pages".encode("utf-16le")
+# カービング: クラスタ先頭で照合するシグネチャ（OLE2 は DOC/XLS/PPT、ZIP は Pages の書類を含む）
+CARVE_SIGNATURE_BYTES = {
+    "JPG": b"\xff\xd8\xff",
+    "PNG": b"\x89PNG\r\n\x1a\n",
+    "PDF": b"%PDF-",
+    "OLE2": b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1",
+    "ZIP": b"PK\x03\x04",
+}
+# 全シグネチャを1つの正規表現にまとめたもの（一致したシグネチャは lastgroup で分かる）
+CARVE_SIGNATURES = re.compile(b"|".join(b"(?P<%s>%s)" % (name.encode(), re.escape(signature)) for name, signature in CARVE_SIGNATURE_BYTES.items()))
+# クラスタ先頭の1バイト目 → 分類文字（S: いずれかのシグネチャの1バイト目, .: 対象外）の変換テーブル
+CARVE_FIRST_BYTES = bytes(ord("S") if byte in {signature[0] for signature in CARVE_SIGNATURE_BYTES.values()} else ord(".") for byte in range(256))
+CARVE_CANDIDATE_PATTERN = re.compile(rb"S")
+# 長さを求める関数の戻り値（読み込んだ範囲では足りない）
+CARVE_NEED_MORE = -1
+# 長さを求めるために最初に読み込むサイズと、広げる上限（これを超えるファイルは切り出さない）
+CARVE_WINDOW = 1024 * 1024
+CARVE_MAX_SIZE = 64 * 1024 * 1024
+# PDFの %%EOF の後の改行と、増分更新（%%EOF の後に続くオブジェクト or 相互参照表）
+PDF_EOL_PATTERN = re.compile(rb"\r\n|\r|\n|")
+PDF_UPDATE_PATTERN = re.compile(rb"\s*(?:\d+\s+\d+\s+obj|xref)")
+PDF_UPDATE_PEEK = 32
+# OLE2のFATの値（未使用セクタ・通常のセクタ番号の上限）
+OLE2_FREE_SECTOR = 0xFFFFFFFF
+OLE2_MAX_SECTOR = 0xFFFFFFFA
+# OLE2のストリーム名 → ファイルタイプ
+OLE2_STREAM_TYPES = [("WordDocument", "DOC"), ("Workbook", "XLS"), ("Book", "XLS"), ("PowerPoint Document", "PPT")]
+# Pages の書類（ZIP）に含まれるファイル名
+PAGES_MEMBERS = (b"Index/Document.iwa", b"index.xml")
+
+
+def decode_entry(data: bytes, current_byte: int, lfn_buffer: list, scan_filter: ScanFilter) -> dict | None:
+    """
+    ファイル/ディレクトリ候補の32バイトエントリを解析して、スキャン結果を返す（対象外の場合はNone）
+    data: 32バイトのディレクトリエントリ
+    current_byte: エントリ末尾のバイト位置
+    lfn_buffer: 直前までに蓄積したLFNエントリ（使用後はクリアする）
+    """
+    (
+        filename_bytes,
+        extension_bytes,
+        attribute_byte,
+        first_cluster_high,
+        time_value,
+        date_value,
+        first_cluster_low,
+        file_size,
+    ) = SFN_ENTRY.unpack(data)
+    is_directory = attribute_byte == 0x10
+    if not ((attribute_byte == 0x20 and file_size > 0) or (is_directory and file_size == 0)):
+        return None
+    # ファイルは、名前や日時をデコードする前に、生の値で判定できる条件を確かめる
+    if not is_directory and scan_filter.rejects_raw(data, extension_bytes, file_size, date_value, time_value, lfn_buffer):
+        lfn_buffer.clear()
+        return None
+
+    # 読み込んだ first_cluster にマスクを適用
+    first_cluster = (first_cluster_high << 16 | first_cluster_low) & FAT32_CLUSTER_MASK
+    # 削除ファイルか？
+    deleted_file = False
+    if data[0] == 0xE5:
+        filename_bytes = b"!" + filename_bytes[1:]  # 「!」に置換
+        deleted_file = True
+
+    filename_str = sanitize_string(
+        filename_bytes.decode("shift_jis", errors="ignore")
+    ).strip()
+    extension_str = sanitize_string(
+        extension_bytes.decode("shift_jis", errors="ignore")
+    ).strip()
+
+    full_filename_str = f"{filename_str}.{extension_str}"
+    # LFNを持っているか
+    if lfn_buffer:
+        # 最初のシーケンス番号が0x40以上か and 最初のシーケンス番号が要素の数と一致しているか？
+        if lfn_buffer[0]["seq"] >= 0x40 and lfn_buffer[0]["seq"] & 0x3F == len(lfn_buffer):
+            # LFNシーケンスをシーケンス番号順にソート（逆順に保存されているため）
+            lfn_buffer.sort(key=lambda x: x["seq"])
+            # バイト列を結合して、UTF-16LE (リトルエンディアン) でデコードし、終端の \x00 を取り除く
+            full_name_bytes = b"".join(part["bytes"] for part in lfn_buffer)
+            try:
+                decoded_full_name = full_name_bytes.decode("utf-16le")
+                full_filename_str = sanitize_string(
+                    decoded_full_name.split("\x00", 1)[0]
+                )
+            except Exception as e:
+                lfn_buffer.clear()
+                return None
+        lfn_buffer.clear()
+
+    # 更新日 (Bit 4～0: 日, Bit 8～5: 月, Bit 15～9: 1980年からの年数)
+    day = date_value & 0x1F
+    month = (date_value >> 5) & 0x0F
+    actual_year = 1980 + ((date_value >> 9) & 0x7F)
+    # 更新時間 (Bit 4～0: 秒/2, Bit 10～5: 分, Bit 15～11: 時)
+    second = (time_value & 0x1F) * 2
+    minute = (time_value >> 5) & 0x3F
+    hour = (time_value >> 11) & 0x1F
     try:
-        # バイナリ読み込みモード ('rb') でドライブを開く
-        print(f"[{drive_path}] の生データ読み込みを開始します...")
+        update_datetime = datetime(actual_year, month, day, hour, minute, second)
+    except Exception as e:
+        # 有効な日付でなければ抜ける
+        return None
+
+    # ディレクトリ or 条件（対象拡張子など）に一致するファイルでなければ抜ける
+    if not (is_directory or scan_filter.accepts(full_filename_str, extension_str, update_datetime)):
+        return None
+    # ディレクトリ and ファイル名が「」か「..」か「.」なら抜ける
+    if is_directory and (filename_str == "" or filename_str == ".." or filename_str == "."):
+        return None
+    # 先頭クラスタ位置がトータルクラスタよりも大きければ無効
+    if first_cluster < 2 or first_cluster > TOTAL_CLUSTERS:
+        return None
+
+    current_cluster = (current_byte - DATA_START_BYTE) // CLUSTER_SIZE + 2
+    return {
+        "current_byte": current_byte,
+        "current_cluster": current_cluster,
+        "filename": full_filename_str,
+        "filetype": extension_str,
+        "size": file_size,
+        "attribute": hex(attribute_byte),
+        "updatetime": update_datetime.strftime("%Y-%m-%d %H:%M:%S"),
+        "first_cluster": first_cluster,
+        "deleted": deleted_file
+    }
+
+
+def scan_buffer(buffer, buffer_start: int, lfn_buffer: list, scan_filter: ScanFilter, scan_results: list):
+    """
+    まとめて読み込んだバッファ内の32バイトエントリを一括で解析し、結果を scan_results に追加する
+    buffer: 32バイトの倍数長のバッファ (bytes / memoryview)
+    buffer_start: バッファ先頭のバイト位置
+    lfn_buffer: LFNエントリの蓄積バッファ（バッファをまたいで引き継ぐ）
+    """
+    # 全スロットの属性バイトを一度に取り出して分類し、候補スロットだけをPythonで処理する
+    classes = bytes(buffer[11::DIR_ENTRY_SIZE]).translate(ATTRIBUTE_CLASSES)
+    previous = -1
+    for match in CANDIDATE_PATTERN.finditer(classes):
+        index = match.start()
+        # 前の候補との間に未使用エントリ (0x00) があれば、LFNエントリをクリア
+        if lfn_buffer and classes.find(b"Z", previous + 1, index) != -1:
+            lfn_buffer.clear()
+        previous = index
+
+        offset = index * DIR_ENTRY_SIZE
+        data = bytes(buffer[offset:offset + DIR_ENTRY_SIZE])
+        if classes[index] == ord("L"):
+            # LFNエントリから名前の断片（13文字分）とチェックサムを取得
+            # バッファに保存（シーケンス番号、バイト列、チェックサム）
+            lfn_buffer.append(
+                {
+                    "seq": data[0],
+                    "bytes": data[1:11] + data[14:26] + data[28:32],
+                    "checksum": data[13],
+                }
+            )
+            continue
+
+        entry = decode_entry(data, buffer_start + offset + DIR_ENTRY_SIZE, lfn_buffer, scan_filter)
+        if entry is None:
+            continue
+        scan_results.append(entry)
+        if VERBOSE:
+            print(f"{entry['current_cluster']}/{TOTAL_CLUSTERS}  ファイルエントリ->{entry['filename']} --- {entry['filetype']} --- {entry['attribute']} --- {entry['size']} bytes --- {entry['first_cluster']}")
+
+    # 末尾の候補以降に未使用エントリがあれば、LFNエントリをクリア
+    if lfn_buffer and classes.find(b"Z", previous + 1) != -1:
+        lfn_buffer.clear()
+
+
+def looks_like_directory_cluster(cluster) -> bool:
+    """
+    クラスタ全体をデコードする前に、ディレクトリのクラスタでありうるかを簡易判定する
+    - 先頭が「.」エントリならディレクトリ
+    - 32バイトごとの属性バイトに予約ビット (0x40, 0x80) が立っていればディレクトリではない
+    - ファイル/ディレクトリ候補の更新日（月・日）が妥当なものが過半数であること
+    """
+    if cluster[:11] == DOT_ENTRY_NAME and cluster[11] == 0x10:
+        return True
+    attributes = bytes(cluster[11::DIR_ENTRY_SIZE])
+    if attributes.translate(None, DIRECTORY_ATTRIBUTES):
+        return False
+    sane_dates = 0
+    insane_dates = 0
+    for match in ENTRY_PATTERN.finditer(attributes.translate(ATTRIBUTE_CLASSES)):
+        date_value = unpack_from("<H", cluster, match.start() * DIR_ENTRY_SIZE + 24)[0]
+        if 1 <= (date_value >> 5) & 0x0F <= 12 and date_value & 0x1F:
+            sane_dates += 1
+        else:
+            insane_dates += 1
+    return sane_dates > insane_dates
+
+
+def scan_directory_clusters(buffer, buffer_start: int, lfn_buffer: list, scan_filter: ScanFilter, scan_results: list, scan_stats: dict):
+    """
+    バッファをクラスタ単位で簡易判定し、ディレクトリ候補のクラスタだけを scan_buffer で解析する
+    スキップしたクラスタをまたいでLFNエントリは引き継がない
+    """
+    run_start = None
+    for cluster_start in range(0, len(buffer), CLUSTER_SIZE):
+        if looks_like_directory_cluster(buffer[cluster_start:cluster_start + CLUSTER_SIZE]):
+            scan_stats["clusters_scanned"] += 1
+            if run_start is None:
+                run_start = cluster_start
+            continue
+        scan_stats["clusters_skipped"] += 1
+        # 直前までの候補クラスタをまとめて解析
+        if run_start is not None:
+            scan_buffer(buffer[run_start:cluster_start], buffer_start + run_start, lfn_buffer, scan_filter, scan_results)
+            run_start = None
+        lfn_buffer.clear()
+    if run_start is not None:
+        scan_buffer(buffer[run_start:], buffer_start + run_start, lfn_buffer, scan_filter, scan_results)
+
+
+def jpeg_length(data: bytes) -> int | None:
+    """
+    JPEGのセグメントを辿り、EOI (FFD9) までの長さを返す
+    戻り値: 長さ / CARVE_NEED_MORE（データが足りない） / None（JPEGではない）
+    """
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:
+            # 埋め草
+            position += 1
+            continue
+        if marker == 0xD9:
+            return position + 2
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            position += 2
+            continue
+        segment_length, = unpack_from(">H", data, position + 2)
+        if segment_length < 2:
+            return None
+        position += 2 + segment_length
+        if marker == 0xDA:
+            # スキャンデータ: FF00（エスケープ）と RST マーカー以外の FF xx が次のマーカー
+            while True:
+                position = data.find(b"\xff", position)
+                if position == -1 or position + 1 >= len(data):
+                    return CARVE_NEED_MORE
+                following = data[position + 1]
+                if following == 0x00 or following == 0xFF or 0xD0 <= following <= 0xD7:
+                    position += 1
+                    continue
+                break
+    return CARVE_NEED_MORE
+
+
+def png_length(data: bytes) -> int | None:
+    """
+    PNGのチャンクを辿り、IEND チャンクの終わりまでの長さを返す
+    """
+    position = 8
+    while position + 12 <= len(data):
+        chunk_length, chunk_type = unpack_from(">I4s", data, position)
+        if chunk_length > 0x7FFFFFFF or not chunk_type.isalpha():
+            return None
+        position += 12 + chunk_length
+        if chunk_type == b"IEND":
+            return position
+    return CARVE_NEED_MORE
+
+
+def pdf_length(data: bytes) -> int | None:
+    """
+    PDFの %%EOF（と改行）までの長さを返す（増分更新で %%EOF の後にオブジェクトが続く場合は、最後の %%EOF まで）
+    """
+    position = 0
+    while True:
+        found = data.find(b"%%EOF", position)
+        if found == -1:
+            return CARVE_NEED_MORE
+        end = PDF_EOL_PATTERN.match(data, found + 5).end()
+        if len(data) - end < PDF_UPDATE_PEEK:
+            # 増分更新が続くかをまだ判断できない
+            return CARVE_NEED_MORE
+        if not PDF_UPDATE_PATTERN.match(data, end):
+            return end
+        position = end
+
+
+def ole2_fat(data: bytes) -> Tuple[int, array] | int | None:
+    """
+    OLE2複合ドキュメントのヘッダーとFATを読み込む
+    戻り値: (セクタサイズ, FAT) / CARVE_NEED_MORE / None（OLE2ではない）
+    """
+    if len(data) < 512:
+        return CARVE_NEED_MORE
+    byte_order, sector_shift = unpack_from("<HH", data, 0x1C)
+    if byte_order != 0xFFFE or sector_shift not in (9, 12):
+        return None
+    sector_size = 1 << sector_shift
+    fat_sector_count, = unpack_from("<I", data, 0x2C)
+    difat_sector, difat_sector_count = unpack_from("<II", data, 0x44)
+    # FATセクタの一覧は、ヘッダー内のDIFAT（109セクタ分）の後、DIFATセクタのチェーンに続く
+    fat_sectors = list(unpack_from("<109I", data, 0x4C))
+    visited = set()
+    while len(fat_sectors) < fat_sector_count and difat_sector <= OLE2_MAX_SECTOR and len(visited) < difat_sector_count:
+        if difat_sector in visited:
+            return None
+        visited.add(difat_sector)
+        start = (difat_sector + 1) * sector_size
+        if start + sector_size > len(data):
+            return CARVE_NEED_MORE
+        # 各DIFATセクタの末尾は次のDIFATセクタの番号
+        *listed, difat_sector = unpack_from(f"<{sector_size // 4}I", data, start)
+        fat_sectors.extend(listed)
+    fat_sectors = fat_sectors[:fat_sector_count]
+    if len(fat_sectors) < fat_sector_count or any(fat_sector > OLE2_MAX_SECTOR for fat_sector in fat_sectors):
+        # FATの一部が分からなければ長さも分からない（途中で切った長さを返さない）
+        return None
+    fat = array("I")
+    for fat_sector in fat_sectors:
+        start = (fat_sector + 1) * sector_size
+        if start + sector_size > len(data):
+            return CARVE_NEED_MORE
+        fat.frombytes(data[start:start + sector_size])
+    if not fat:
+        return None
+    if sys.byteorder == "big":
+        fat.byteswap()
+    return sector_size, fat
+
+
+def ole2_length(data: bytes) -> int | None:
+    """
+    OLE2複合ドキュメントのFATから使用中の最後のセクタを求めて長さを返す
+    """
+    header = ole2_fat(data)
+    if not isinstance(header, tuple):
+        return header
+    sector_size, fat = header
+    last_sector = max((index for index, value in enumerate(fat) if value != OLE2_FREE_SECTOR), default=None)
+    if last_sector is None:
+        return None
+    # セクタ0はヘッダーの直後から始まる
+    return (last_sector + 2) * sector_size
+
+
+def ole2_filetype(data: bytes) -> str | None:
+    """
+    OLE2複合ドキュメントのディレクトリのストリーム名から、DOC / XLS / PPT を判別する
+    """
+    header = ole2_fat(data)
+    if not isinstance(header, tuple):
+        return None
+    sector_size, fat = header
+    names = set()
+    sector, = unpack_from("<I", data, 0x30)
+    visited = set()
+    while sector <= OLE2_MAX_SECTOR and sector < len(fat) and sector not in visited:
+        visited.add(sector)
+        start = (sector + 1) * sector_size
+        for entry in range(start, min(start + sector_size, len(data) - 127), 128):
+            name_length, = unpack_from("<H", data, entry + 64)
+            if 2 <= name_length <= 64:
+                names.add(data[entry:entry + name_length - 2].decode("utf-16le", errors="replace"))
+        sector = fat[sector]
+    for name, filetype in OLE2_STREAM_TYPES:
+        if name in names:
+            return filetype
+    return None
+
+
+def zip_length(data: bytes) -> int | None:
+    """
+    ZIPの終端レコード（中央ディレクトリの位置とサイズが一致するもの）までの長さを返す
+    """
+    position = 0
+    while True:
+        position = data.find(b"PK\x05\x06", position)
+        if position == -1 or position + 22 > len(data):
+            return CARVE_NEED_MORE
+        directory_size, directory_offset, comment_length = unpack_from("<IIH", data, position + 12)
+        if directory_offset + directory_size == position:
+            return position + 22 + comment_length
+        position += 4
+
+
+# シグネチャ → 長さを求める関数（ファイルの終端・ヘッダーから）
+CARVERS = {
+    "JPG": jpeg_length,
+    "PNG": png_length,
+    "PDF": pdf_length,
+    "OLE2": ole2_length,
+    "ZIP": zip_length,
+}
+
+
+def carve_file(volume: Volume, offset: int, signature: str) -> Tuple[str, int] | None:
+    """
+    クラスタ先頭で見つかったシグネチャから、ファイルタイプと長さを求める
+    長さが分かるまで読み込む範囲を CARVE_MAX_SIZE まで広げる
+    """
+    window = CARVE_WINDOW
+    try:
+        while True:
+            data = bytes(volume.read(offset, window))
+            length = CARVERS[signature](data)
+            if length == CARVE_NEED_MORE and window < CARVE_MAX_SIZE and len(data) == window:
+                window = min(window * 4, CARVE_MAX_SIZE)
+                continue
+            break
+        if length is None or length == CARVE_NEED_MORE or length <= 0:
+            return None
+        if signature == "OLE2":
+            filetype = ole2_filetype(data[:length])
+        elif signature == "ZIP":
+            # Pages の書類はZIP形式のパッケージ
+            filetype = "PAG" if any(name in data[:length] for name in PAGES_MEMBERS) else "ZIP"
+        else:
+            filetype = signature
+    except (error, ValueError, IndexError, TypeError):
+        # 壊れたファイル（偶然一致したシグネチャ）はスキップし、スキャンは続ける
+        return None
+    return (filetype, length) if filetype else None
+
+
+def carve_buffer(volume: Volume, buffer, buffer_start: int, scan_filter: ScanFilter, scan_results: list):
+    """
+    バッファ内の各クラスタの先頭をシグネチャと照合し、見つかったファイルを scan_results に追加する
+    クラスタ先頭の1バイト目で候補を絞り込み（bytes.translate）、候補だけを全シグネチャの正規表現と一度に照合する
+    """
+    first_offset = -(buffer_start - DATA_START_BYTE) % CLUSTER_SIZE
+    heads = bytes(buffer[first_offset::CLUSTER_SIZE]).translate(CARVE_FIRST_BYTES)
+    for match in CARVE_CANDIDATE_PATTERN.finditer(heads):
+        offset = first_offset + match.start() * CLUSTER_SIZE
+        signature = CARVE_SIGNATURES.match(buffer, offset, offset + 8)
+        if signature is None:
+            continue
+        carved = carve_file(volume, buffer_start + offset, signature.lastgroup)
+        if carved is None or not scan_filter.accepts_carved(*carved):
+            continue
+        filetype, size = carved
+        cluster = (buffer_start + offset - DATA_START_BYTE) // CLUSTER_SIZE + 2
+        entry = {
+            "current_byte": buffer_start + offset,
+            "current_cluster": cluster,
+            "filename": f"CARVED_{cluster:08d}.{filetype.lower()}",
+            "filetype": filetype,
+            "size": size,
+            "attribute": "0x20",
+            "updatetime": "",
+            "first_cluster": cluster,
+            "deleted": False,
+            "path": "CARVED",
+            "origin": "carve",
+        }
+        scan_results.append(entry)
+        if VERBOSE:
+            print(f"{cluster}/{TOTAL_CLUSTERS}  カービング->{entry['filename']} --- {filetype} --- {size} bytes")
+
+
+def current_geometry() -> dict:
+    """
+    現在のボリューム情報（グローバル変数）を辞書で返す（ワーカープロセスへの受け渡し用）
+    """
+    return {
+        "DATA_START_BYTE": DATA_START_BYTE,
+        "CLUSTER_SIZE": CLUSTER_SIZE,
+        "RESERVED_SECTORS": RESERVED_SECTORS,
+        "BYTES_PER_SECTOR": BYTES_PER_SECTOR,
+        "FATSize": FATSize,
+        "TOTAL_SECTORS": TOTAL_SECTORS,
+        "TOTAL_CLUSTERS": TOTAL_CLUSTERS,
+        "ROOT_CLUSTER": ROOT_CLUSTER,
+        "SOURCE": SOURCE,
+    }
+
 
-        with open(drive_path, "rb") as f:
-            # データを読み込む
-            raw_data = f.read(READ_SIZE)
-
-            # 読み込んだデータサイズを確認
-            actual_size = len(raw_data)
-            print(f"成功: {actual_size} バイトのデータを読み込みました。")
-
-            ## --- ここから読み込んだデータの確認 --- ##
-
-            # 1. データ全体の先頭16バイトを16進数で表示
-            print("\n--- 先頭16バイト (16進数) ---")
-            # b'' 形式で出力されるのを避けるために .hex() を使うと綺麗よ
-            print(raw_data[:16].hex())
-
-            # 2. 最初の512バイト（ブートセクタ）を別のファイルに保存して確認するのもアリ！
-            # with open("D_boot_sector.bin", "wb") as out_f:
-            #     out_f.write(raw_data[:512])
-            # print("\n最初の512バイトを [D_boot_sector.bin] に保存しました。")
-
-            # 3. FAT32の署名（510-511バイト目）を確認
-            # FATのブートセクタの最後の2バイトは必ず 0x55AA になっているはずよ！
-            boot_signature = raw_data[510:512]
-            print("\n--- ブートシグネチャ (510-511バイト目) ---")
-            # リトルエンディアンで 'AA 55' と表示されるはずよ
-            print(boot_signature.hex())
-
-            if boot_signature == b"\x55\xaa":
-                print("✔ ブートシグネチャ [0x55AA] を確認！これは有効なブートセクタよ。")
-                BYTES_PER_SECTOR = unpack("<H", raw_data[11:13])[0]
-                print(f"BYTES_PER_SECTOR: {BYTES_PER_SECTOR}")
-                SectorsPerCluster = unpack("<B", raw_data[13:14])[0]
-                print(f"SectorsPerCluster: {SectorsPerCluster}")
-                RESERVED_SECTORS = unpack("<H", raw_data[14:16])[0]
-                print(f"RESERVED_SECTORS: {RESERVED_SECTORS}")
-                FATCount = unpack("<B", raw_data[16:17])[0]
-                print(f"FATCount: {FATCount}")
-                RootDirectoryEntries = unpack("<I", raw_data[44:48])[0]
-                print(f"RootDirectoryEntries: {RootDirectoryEntries}")
-                FATSize = unpack("<I", raw_data[36:40])[0]
-                print(f"FATSize: {FATSize}")
-                TOTAL_SECTORS = unpack("<I", raw_data[32:36])[0]
-                print(f"TOTAL_SECTORS: {TOTAL_SECTORS}")
-                # RootDirectoryCluster = unpack("<H", raw_data[21:23])
-                # print(f"RootDirectoryCluster: {RootDirectoryCluster}")
-                # FSInfoSector = unpack("<H", raw_data[23:25])
-                # print(f"FSInfoSector: {FSInfoSector}")
-                # BackupBootSector = unpack("<H", raw_data[25:27])
-                # print(f"BackupBootSector: {BackupBootSector}")
-                # BackupDataSector = unpack("<H", raw_data[27:29])
-                # print(f"BackupDataSector: {BackupDataSector}")
-
-                data_start_sector = RESERVED_SECTORS + (FATCount * FATSize)
-                print(f"data_start_sector: {data_start_sector}")
-
-                DATA_START_BYTE = data_start_sector * BYTES_PER_SECTOR
-                print(f"DATA_START_BYTE: {DATA_START_BYTE}")
-
-                CLUSTER_SIZE = SectorsPerCluster * BYTES_PER_SECTOR
-                print(f"CLUSTER_SIZE: {CLUSTER_SIZE}")
-                
-                TOTAL_CLUSTERS = (TOTAL_SECTORS * BYTES_PER_SECTOR - DATA_START_BYTE) // CLUSTER_SIZE
-                print(f"TOTAL_SECTORS: {TOTAL_CLUSTERS}")
-
-                f.seek(DATA_START_BYTE)
-                byte_read = 0
-                lfn_buffer = []
-                scan_results = []
-                deleted_file = False
-                while True: # byte_read < BYTES_PER_SECTOR * 1024 * 1024 * 2 * 1:
-                    deleted_file = False
-                    data = f.read(32)
-
-                    # ファイルの終端に達したら、f.read() は空のバイト列 (b'') を返す
-                    if not data:
-                        print("ドライブの物理的な終端に到達しました。スキャンを終了します。")
-                        break
-                    
-                    # 💡 データが32バイト未満の場合 (ドライブの終端が32の倍数でない場合)
-                    if len(data) < 32:
-                        print(f"終端で {len(data)} バイトを読み込みました。スキャンを終了します。")
-                        break
-
-                    byte_read += 32
-
-                    (
-                        filename_bytes,
-                        extension_bytes,
-                        attribute_byte,
-                        first_cluster,
-                        file_size,
-                    ) = unpack("<8s 3s B L L", data[:12] + data[26:28] + data[20:22] + data[28:32])
-
-                    # 読み込んだ first_cluster にマスクを適用
-                    first_cluster = first_cluster & FAT32_CLUSTER_MASK
-                    # 先頭クラスタ位置がトータルクラスタよりも大きければ無効
-                    # if first_cluster < 2 or first_cluster > TOTAL_CLUSTERS:
-                    #     continue
-                    # --- LFN (0x0F)とその他の属性のチェック ---
-                    if (attribute_byte & 0x0F) == 0x0F:
-                        # sequence_number = (
-                        #     data[0] & 0x3F
-                        # )  # 0x3F (63) でマスクして上位ビット（0x40）を無視
-                        # LFNエントリから名前の断片（13文字分）とチェックサムを取得
-                        lfn_name_part_bytes = data[1:11] + data[14:26] + data[28:32]
-                        # バッファに保存（シーケンス番号、バイト列、チェックサム）
-                        lfn_buffer.append(
-                            {
-                                "seq": data[0],
-                                "bytes": lfn_name_part_bytes,
-                                "checksum": data[13],
-                                # ... 他の情報も保存
-                            }
-                        )
-                        continue  # 次の32バイトへ
-
-                    # 属性が 0x00 の場合、空のエントリか未使用の場所なのでスキップ
-                    if attribute_byte == 0x00:
-                        # 0x00を見つけたら、それ以降は未使用の可能性が高いから、セクタの残りもスキップして次のセクタへ移動してもいいくらいよ。
-                        # print("  -> 未使用エントリをスキップ")
-                        # 一応LFNエントリをクリア
-                        lfn_buffer = []
-                        continue  # 次の32バイトへ
-
-                    # 属性が有効なファイル・ディレクトリであることを確認
-                    # ここでは、属性値が 0x0F (LFN) を含まない、有効な属性ビットのいずれかを持っているか確認
-                    if attribute_byte & VALID_ATTRIBUTES and not (attribute_byte & 0x0F):
-                        # 有効なファイルまたはディレクトリのエントリである可能性が高い！
-                        # 削除ファイルか？
-                        if data[0:1] == b"\xe5":
-                            filename_list = list(filename_bytes)
-                            filename_list[0] = 0x21 # 「!」に置換
-                            filename_bytes = bytes(filename_list)
-                            deleted_file = True
-
-                        filename_str = sanitize_string(
-                            filename_bytes.decode("shift_jis", errors="ignore")
-                        ).strip()
-                        extension_str = sanitize_string(
-                            extension_bytes.decode("shift_jis", errors="ignore")
-                        ).strip()
-
-                        # if filename_str != "" and extension_str != "":
-                            # if extension_str in ["DOC", "XLS", "JPG", "PDF", "PNG", "PPT", "PAG"] and (attribute_byte & 0x20) != 0 or ((attribute_byte & 0x10) != 0 and file_size == 0):
-                        if (hex(attribute_byte >> 4) == '0x2' and file_size > 0) or (hex(attribute_byte >> 4) == '0x1' and file_size == 0):
-                            full_filename_str = f"{filename_str}.{extension_str}"
-                            # LFNを持っているか
-                            if lfn_buffer:
-                                # 最初のシーケンス番号が0x40以上か and 最初のシーケンス番号が要素の数と一致しているか？
-                                if lfn_buffer[0]["seq"] >= 0x40 and lfn_buffer[0]["seq"] & 0x3F == len(lfn_buffer):
-                                    # 3. LFNシーケンスをシーケンス番号順にソート（逆順に保存されているため）
-                                    lfn_buffer.sort(key=lambda x: x["seq"])
-                                    # 4. バイト列を結合して、UTF-16でデコード
-                                    full_name_bytes = b""
-                                    for part in lfn_buffer:
-                                        full_name_bytes += bytes(part["bytes"])
-                                    # UTF-16LE (リトルエンディアン) でデコードし、終端の \x00 を取り除く
-                                    try:
-                                        decoded_full_name = full_name_bytes.decode("utf-16le")
-                                        full_filename_str = sanitize_string(
-                                            decoded_full_name.split("\x00", 1)[0]
-                                        )
-                                    except Exception as e:
-                                        lfn_buffer = []
-                                        continue
-                                lfn_buffer = []
-
-                            # 更新日
-                            # とりあえず現在時刻をセット
-                            update_datetime = datetime.now()
-                            date_value = unpack("<H", data[24:26])[0]
-                            # 1. 日（Bit 4～0）の抽出
-                            day = (
-                                date_value & 0x1F
-                            )  # 0x1F は 0b00011111 (5ビットすべて1)
-                            # 2. 月（Bit 8～5）の抽出
-                            month = (
-                                date_value >> 5
-                            ) & 0x0F  # 0x0F は 0b00001111 (4ビットすべて1)
-                            # 3. 年（Bit 15～9）の抽出
-                            # 0x7F は 0b01111111 (7ビットすべて1)
-                            year_offset = (date_value >> 9) & 0x7F
-                            actual_year = 1980 + year_offset
-
-                            # 更新時間
-                            time_value = unpack("<H", data[22:24])[0]
-                            # 1. 秒（Bit 4～0）の抽出
-                            second = (
-                                time_value & 0x1F
-                            ) * 2  # 0x1F は 0b00011111 (5ビットすべて1)
-                            # 2. 分（Bit 10～5）の抽出
-                            minute = (
-                                time_value >> 5
-                            ) & 0b00111111  # 0x3F は 0b00111111 (6ビットすべて1)
-                            # 3. 時（Bit 15～11）の抽出
-                            # 0x1F は 0b00011111 (5ビットすべて1)
-                            hour = (time_value >> 11) & 0x1F
-
-                            try:
-                                update_datetime = datetime(actual_year, month, day, hour, minute, second)
-                            except Exception as e:
-                                # 有効な日付でなければ抜ける
-                                continue
-                            
-                            # ディレクトリ or 対象拡張子でなければ抜ける
-                            if not (extension_str in target_exts  or full_filename_str[-6:] == '.pages' or (hex(attribute_byte >> 4) == '0x1' and file_size == 0)):
-                                # if not (extension_str in ["DOC", "XLS", "JPG", "PDF", "PNG", "PPT", "PAG"]  or full_filename_str[-6:] == '.pages'):
-                                #     print(f"対象外ファイルタイプ : {extension_str} - {full_filename_str[-6:]}")
-                                continue
-                            # ディレクトリ and ファイル名が「」か「..」か「.」なら抜ける
-                            if hex(attribute_byte >> 4) == '0x1' and file_size == 0 and (filename_str == "" or filename_str == ".." or filename_str == "."):
-                                continue
-                            # 先頭クラスタ位置がトータルクラスタよりも大きければ無効
-                            if (first_cluster < 2 or first_cluster > TOTAL_CLUSTERS):
-                                pass
-                                continue
-
-                            current_byte = f.tell()
-                            current_cluster = (current_byte - DATA_START_BYTE) // CLUSTER_SIZE  + 2
-                            scan_results.append({
-                                "current_byte": current_byte,
-                                "current_cluster": current_cluster,
-                                "filename": full_filename_str,
-                                "filetype": extension_str,
-                                "size": file_size,
-                                "attribute": hex(attribute_byte),
-                                "updatetime": update_datetime.strftime("%Y-%m-%d %H:%M:%S"),
-                                "first_cluster": first_cluster,
-                                "deleted": deleted_file
-                            })
-                            
-                            print(f"{current_cluster}/{TOTAL_CLUSTERS}  ファイルエントリ->{full_filename_str} --- {extension_str} --- {hex(attribute_byte)} --- {file_size} bytes --- {first_cluster}")
-                # whileループ脱出後
-                # excelに保存
-                save_to_excel(scan_results, xlsx_file)
+def set_geometry(geometry: dict):
+    """
+    current_geometry() で取得したボリューム情報をグローバル変数に設定する
+    """
+    globals().update(geometry)
 
+
+def iter_scan_range(volume: Volume, start: int, end: int | None, lfn_buffer: list, scan_filter: ScanFilter, prefilter: bool = False, scan_stats: dict | None = None, carve: bool = False) -> Iterator[Tuple[int, int, list]]:
+    """
+    start から end（None の場合はドライブの終端）までをブロック単位で読み込んでスキャンし、
+    ブロックごとに (ブロックの先頭バイト位置, 読み込んだバイト数, そのブロックで見つけたエントリのリスト) を返すジェネレータ
+    ドライブの終端では読み込んだバイト数が 0 または 32 の倍数でないブロックを返して終わる
+    READ_AHEAD_BLOCKS > 0 の場合は、別スレッドで先のブロックを読み込みながら解析する
+    """
+    # 一度に読み込むサイズ（クラスタ境界に揃える）
+    block_size = max(CLUSTER_SIZE, SCAN_BLOCK_SIZE // CLUSTER_SIZE * CLUSTER_SIZE)
+    with ReadAhead(volume, start, end, block_size, READ_AHEAD_BLOCKS) as blocks:
+        for block_start, data in blocks:
+            # 💡 32バイトに満たない端数はエントリとして扱わない (ドライブの終端が32の倍数でない場合)
+            buffer = data[:len(data) - len(data) % DIR_ENTRY_SIZE]
+            block_results = []
+            if prefilter:
+                scan_directory_clusters(buffer, block_start, lfn_buffer, scan_filter, block_results, scan_stats)
             else:
-                print("⚠ ブートシグネチャが見つかりません。ドライブへのアクセスに問題があるかも...")
+                scan_buffer(buffer, block_start, lfn_buffer, scan_filter, block_results)
+            if carve:
+                carve_buffer(volume, buffer, block_start, scan_filter, block_results)
+            yield block_start, len(data), block_results
+
+
+def scan_range(volume: Volume, start: int, end: int | None, lfn_buffer: list, scan_filter: ScanFilter, scan_results: list, prefilter: bool = False, scan_stats: dict | None = None, on_block: Callable[[int], None] | None = None, progress: ProgressReporter | None = None, carve: bool = False):
+    """
+    start から end（None の場合はドライブの終端）までをブロック単位で読み込んでスキャンする
+    prefilter: ディレクトリ候補のクラスタだけを解析する（件数は scan_stats に加算）
+    on_block: ブロックを処理し終えるたびに、次に読むバイト位置を引数に呼び出す
+    progress: ブロックごとに進捗を反映し、スキャンを終えたら最終的な進捗を表示する
+    carve: クラスタ先頭のシグネチャからファイルを切り出す（カービング）
+    """
+    for block_start, read_size, block_results in iter_scan_range(volume, start, end, lfn_buffer, scan_filter, prefilter, scan_stats, carve):
+        # ファイルの終端に達したら、空のバッファが返る
+        if not read_size:
+            if progress is not None:
+                progress.finish()
+            print("ドライブの物理的な終端に到達しました。スキャンを終了します。")
+            break
+        scan_results.extend(block_results)
+        if progress is not None:
+            progress.advance(block_start + read_size, len(block_results))
+        # 終端の端数のブロックで見つけたエントリも、チェックポイントの保存対象にする
+        if on_block is not None:
+            on_block(block_start + read_size)
+        remainder = read_size % DIR_ENTRY_SIZE
+        if remainder:
+            if progress is not None:
+                progress.finish()
+            print(f"終端で {remainder} バイトを読み込みました。スキャンを終了します。")
+            break
+    if progress is not None:
+        progress.finish()
+
+
+def find_lfn_reset(volume: Volume, start: int, end: int | None) -> int | None:
+    """
+    start 以降で、LFNバッファが必ず空になる最初のスロット（未使用エントリ or LFNを消費するファイル/ディレクトリエントリ）の
+    末尾バイト位置を返す。これより前の結果は、直前の範囲から引き継いだLFNエントリの影響を受ける。
+    見つからない場合は None
+    """
+    block_size = max(CLUSTER_SIZE, SCAN_BLOCK_SIZE // CLUSTER_SIZE * CLUSTER_SIZE)
+    block_start = start
+    while end is None or block_start < end:
+        data = volume.read(block_start, block_size if end is None else min(block_size, end - block_start))
+        data = data[:len(data) - len(data) % DIR_ENTRY_SIZE]
+        if not data:
+            return None
+        classes = bytes(data[11::DIR_ENTRY_SIZE]).translate(ATTRIBUTE_CLASSES)
+        for match in RESET_PATTERN.finditer(classes):
+            offset = match.start() * DIR_ENTRY_SIZE
+            if classes[match.start()] == ord("E"):
+                attribute_byte, file_size = data[offset + 11], unpack_from("<I", data, offset + 28)[0]
+                if not ((attribute_byte == 0x20 and file_size > 0) or (attribute_byte == 0x10 and file_size == 0)):
+                    continue
+            return block_start + offset + DIR_ENTRY_SIZE
+        block_start += len(data)
+    return None
+
+
+def scan_partition(source: str, geometry: dict, start: int, end: int | None, scan_filter: ScanFilter, prefilter: bool = False, carve: bool = False) -> Tuple[list, list, int | None, dict]:
+    """
+    データ領域の一部（クラスタ境界で区切った範囲）をスキャンする（ワーカープロセスで実行）
+    戻り値: (スキャン結果, 範囲末尾で未消費のLFNエントリ, find_lfn_reset の位置, スキャン件数)
+    """
+    set_geometry(geometry)
+    lfn_buffer = []
+    scan_results = []
+    scan_stats = {"clusters_scanned": 0, "clusters_skipped": 0}
+    # 親プロセスから引き継いだハンドルは使わず、ワーカーごとに開き直す
+    with Volume(source) as volume:
+        volume.limit_to_boot_sector()
+        scan_range(volume, start, end, lfn_buffer, scan_filter, scan_results, prefilter, scan_stats, carve=carve)
+        reset_byte = find_lfn_reset(volume, start, end)
+        scan_stats["read_calls"] = volume.read_calls
+        scan_stats["bytes_read"] = volume.bytes_read
+    return scan_results, lfn_buffer, reset_byte, scan_stats
 
+
+def scan_partitioned(volume: Volume, scan_filter: ScanFilter, jobs: int, prefilter: bool = False, scan_stats: dict | None = None, carve: bool = False) -> list:
+    """
+    データ領域をクラスタ境界で jobs 個の範囲に分割し、ワーカープロセスで並列にスキャンしてディスク順に結合する
+    範囲をまたぐLFNエントリは、直前の範囲の未消費LFNを引き継いで境界付近だけを再スキャンしてつなぎ合わせる
+    """
+    clusters_per_partition = -(-TOTAL_CLUSTERS // jobs)
+    boundaries = [DATA_START_BYTE + i * clusters_per_partition * CLUSTER_SIZE for i in range(jobs)]
+    ranges = [(start, boundaries[i + 1] if i + 1 < jobs else None) for i, start in enumerate(boundaries)]
+
+    progress = ProgressReporter(DATA_START_BYTE, TOTAL_SECTORS * BYTES_PER_SECTOR)
+    partitions = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for (start, end), partition in zip(ranges, executor.map(
+            scan_partition,
+            [volume.source] * jobs,
+            [current_geometry()] * jobs,
+            [start for start, end in ranges],
+            [end for start, end in ranges],
+            [scan_filter] * jobs,
+            [prefilter] * jobs,
+            [carve] * jobs,
+        )):
+            # 範囲の順に、スキャンを終えた範囲の末尾までを進捗として表示
+            partitions.append(partition)
+            progress.advance(end or TOTAL_SECTORS * BYTES_PER_SECTOR, len(partition[0]))
+    progress.finish()
+
+    scan_results = []
+    lfn_buffer = []
+    for (start, end), (partition_results, partition_lfn_buffer, reset_byte, partition_stats) in zip(ranges, partitions):
+        if scan_stats is not None:
+            for key, value in partition_stats.items():
+                scan_stats[key] = scan_stats.get(key, 0) + value
+        if lfn_buffer:
+            # 直前の範囲から引き継いだLFNがある場合、LFNバッファが空になる位置（を含むクラスタの終端）までを逐次スキャンし直す
+            stitch_end = end
+            if reset_byte is not None:
+                stitch_end = DATA_START_BYTE + -(-(reset_byte - DATA_START_BYTE) // CLUSTER_SIZE) * CLUSTER_SIZE
+                if end is not None:
+                    stitch_end = min(stitch_end, end)
+            scan_range(volume, start, stitch_end, lfn_buffer, scan_filter, scan_results, prefilter, {"clusters_scanned": 0, "clusters_skipped": 0})
+            # カービングの結果はLFNの引き継ぎに影響されないため、範囲内のものをそのまま使う
+            scan_results.extend(entry for entry in partition_results if entry["current_byte"] > stitch_end or entry.get("origin") == "carve")
+            if reset_byte is not None:
+                lfn_buffer = partition_lfn_buffer
+        else:
+            scan_results.extend(partition_results)
+            lfn_buffer = partition_lfn_buffer
+    return scan_results
+
+
+def scan_tree(volume: Volume, scan_filter: ScanFilter) -> list:
+    """
+    ルートディレクトリのクラスタから、FATのクラスタチェーンを辿ってディレクトリツリーを巡回し、
+    ディレクトリのクラスタだけをスキャンする（削除済みのサブディレクトリも辿る）
+    各エントリには巡回中に分かった親ディレクトリのパスを "path" として設定する
+    """
+    fat = load_fat(volume.source)
+    scan_results = []
+    bytes_read = 0
+    # (ディレクトリの先頭クラスタ, そのディレクトリのパス)
+    directory_queue = deque([(ROOT_CLUSTER, "ROOT")])
+    visited = {ROOT_CLUSTER}
+    while directory_queue:
+        directory_cluster, directory_path = directory_queue.popleft()
+        # 削除済みディレクトリはFATが解放されているため、先頭クラスタのみとなる
+        lfn_buffer = []
+        directory_results = []
+        for start_cluster, cluster_count in cluster_extents(fat.chain(directory_cluster)):
+            start_byte = DATA_START_BYTE + (start_cluster - 2) * CLUSTER_SIZE
+            data = volume.read(start_byte, cluster_count * CLUSTER_SIZE)
+            bytes_read += len(data)
+            scan_buffer(data[:len(data) - len(data) % DIR_ENTRY_SIZE], start_byte, lfn_buffer, scan_filter, directory_results)
+
+        for entry in directory_results:
+            entry["path"] = directory_path
+            # サブディレクトリをキューに追加
+            if entry["attribute"] == "0x10" and entry["first_cluster"] not in visited:
+                visited.add(entry["first_cluster"])
+                directory_queue.append((entry["first_cluster"], f"{directory_path}\\{entry['filename']}"))
+        scan_results.extend(directory_results)
+
+    print(f"ディレクトリ {len(visited)} 件、{bytes_read:,} バイトを読み込みました。")
+    # スイープ時と同じくディスク上の位置順に並べる
+    scan_results.sort(key=lambda entry: entry["current_byte"])
+    return scan_results
+
+
+def parse_boot_sector(raw_data, report: bool = True) -> bool:
+    global DATA_START_BYTE, CLUSTER_SIZE, RESERVED_SECTORS, BYTES_PER_SECTOR, FATSize, TOTAL_SECTORS, TOTAL_CLUSTERS, ROOT_CLUSTER
+    """
+    ブートセクタからボリューム情報を読み取り、グローバル変数に設定する
+    report: 読み取った内容を表示する
+    戻り値: 有効なブートセクタ（シグネチャ 0x55AA）だったか
+    """
+    log = print if report else lambda *values: None
+    # 読み込んだデータサイズを確認
+    actual_size = len(raw_data)
+    log(f"成功: {actual_size} バイトのデータを読み込みました。")
+
+    ## --- ここから読み込んだデータの確認 --- ##
+
+    # 1. データ全体の先頭16バイトを16進数で表示
+    log("\n--- 先頭16バイト (16進数) ---")
+    # b'' 形式で出力されるのを避けるために .hex() を使うと綺麗よ
+    log(raw_data[:16].hex())
+
+    # 2. 最初の512バイト（ブートセクタ）を別のファイルに保存して確認するのもアリ！
+    # with open("D_boot_sector.bin", "wb") as out_f:
+    #     out_f.write(raw_data[:512])
+    # print("\n最初の512バイトを [D_boot_sector.bin] に保存しました。")
+
+    # 3. FAT32の署名（510-511バイト目）を確認
+    # FATのブートセクタの最後の2バイトは必ず 0x55AA になっているはずよ！
+    boot_signature = raw_data[510:512]
+    log("\n--- ブートシグネチャ (510-511バイト目) ---")
+    # リトルエンディアンで 'AA 55' と表示されるはずよ
+    log(boot_signature.hex())
+
+    if boot_signature == b"\x55\xaa":
+        log("✔ ブートシグネチャ [0x55AA] を確認！これは有効なブートセクタよ。")
+        BYTES_PER_SECTOR = unpack("<H", raw_data[11:13])[0]
+        log(f"BYTES_PER_SECTOR: {BYTES_PER_SECTOR}")
+        SectorsPerCluster = unpack("<B", raw_data[13:14])[0]
+        log(f"SectorsPerCluster: {SectorsPerCluster}")
+        RESERVED_SECTORS = unpack("<H", raw_data[14:16])[0]
+        log(f"RESERVED_SECTORS: {RESERVED_SECTORS}")
+        FATCount = unpack("<B", raw_data[16:17])[0]
+        log(f"FATCount: {FATCount}")
+        ROOT_CLUSTER = unpack("<I", raw_data[44:48])[0]
+        log(f"ROOT_CLUSTER: {ROOT_CLUSTER}")
+        FATSize = unpack("<I", raw_data[36:40])[0]
+        log(f"FATSize: {FATSize}")
+        TOTAL_SECTORS = unpack("<I", raw_data[32:36])[0]
+        log(f"TOTAL_SECTORS: {TOTAL_SECTORS}")
+        # RootDirectoryCluster = unpack("<H", raw_data[21:23])
+        # print(f"RootDirectoryCluster: {RootDirectoryCluster}")
+        # FSInfoSector = unpack("<H", raw_data[23:25])
+        # print(f"FSInfoSector: {FSInfoSector}")
+        # BackupBootSector = unpack("<H", raw_data[25:27])
+        # print(f"BackupBootSector: {BackupBootSector}")
+        # BackupDataSector = unpack("<H", raw_data[27:29])
+        # print(f"BackupDataSector: {BackupDataSector}")
+
+        data_start_sector = RESERVED_SECTORS + (FATCount * FATSize)
+        log(f"data_start_sector: {data_start_sector}")
+
+        DATA_START_BYTE = data_start_sector * BYTES_PER_SECTOR
+        log(f"DATA_START_BYTE: {DATA_START_BYTE}")
+
+        CLUSTER_SIZE = SectorsPerCluster * BYTES_PER_SECTOR
+        log(f"CLUSTER_SIZE: {CLUSTER_SIZE}")
+        
+        TOTAL_CLUSTERS = (TOTAL_SECTORS * BYTES_PER_SECTOR - DATA_START_BYTE) // CLUSTER_SIZE
+        log(f"TOTAL_SECTORS: {TOTAL_CLUSTERS}")
+
+        return True
+    return False
+
+
+def is_fat32_boot_sector(sector) -> bool:
+    """
+    セクタが FAT32 のブートセクタ（シグネチャ 0x55AA と妥当な BPB）か
+    MBR やパーティションテーブルも 0x55AA で終わるため、BPB の値も確認する
+    """
+    if len(sector) < 512 or sector[510:512] != b"\x55\xaa" or sector[0] not in (0xEB, 0xE9):
+        return False
+    bytes_per_sector, sectors_per_cluster, reserved_sectors, fat_count = unpack("<HBHB", sector[11:17])
+    fat_size_16, fat_size_32 = unpack("<H", sector[22:24])[0], unpack("<I", sector[36:40])[0]
+    return bool(
+        bytes_per_sector in (512, 1024, 2048, 4096)
+        and sectors_per_cluster and sectors_per_cluster & (sectors_per_cluster - 1) == 0
+        and reserved_sectors and fat_count
+        and fat_size_16 == 0 and fat_size_32
+    )
+
+
+def find_boot_sector(volume: Volume, offset: int = 0) -> Tuple[bytes | None, bool]:
+    """
+    offset（ボリュームの先頭）の FAT32 のブートセクタを返す
+    壊れている場合はバックアップブートセクタ（BACKUP_BOOT_SECTOR セクタ目）を探す
+    戻り値: (ブートセクタ（見つからなければ None）, バックアップを使ったか)
+    """
+    sector = bytes(volume.read(offset, 512))
+    if is_fat32_boot_sector(sector):
+        return sector, False
+    # 壊れたブートセクタのセクタサイズは当てにならないため、候補のサイズを順に試す
+    for sector_size in PARTITION_SECTOR_SIZES:
+        backup = bytes(volume.read(offset + BACKUP_BOOT_SECTOR * sector_size, 512))
+        if is_fat32_boot_sector(backup) and unpack("<H", backup[11:13])[0] == sector_size:
+            return backup, True
+    return None, False
+
+
+def mbr_partitions(volume: Volume, sector_size: int = 512) -> List[Tuple[int, int, int]]:
+    """
+    MBR のパーティションテーブルから (番号, タイプ, 先頭のバイトオフセット) のリストを返す
+    拡張パーティションは中の EBR を辿り、論理パーティションに 5 から番号を振る
+    """
+    partitions = []
+    extended_start = None
+    table = volume.read(MBR_TABLE_OFFSET, MBR_ENTRIES * MBR_ENTRY.size)
+    for number, (_, partition_type, first_lba, _) in enumerate(MBR_ENTRY.iter_unpack(table), 1):
+        if partition_type in EXTENDED_PARTITION_TYPES:
+            extended_start = first_lba
+        elif partition_type and first_lba:
+            partitions.append((number, partition_type, first_lba * sector_size))
+    # EBR は「論理パーティション（EBR からの相対位置）」と「次の EBR（拡張パーティションからの相対位置）」を持つ
+    ebr_lba, number, visited = extended_start, 5, set()
+    while ebr_lba and ebr_lba not in visited and len(visited) < 128:
+        visited.add(ebr_lba)
+        ebr = volume.read(ebr_lba * sector_size, 512)
+        if len(ebr) < 512 or ebr[510:512] != b"\x55\xaa":
+            break
+        entries = list(MBR_ENTRY.iter_unpack(ebr[MBR_TABLE_OFFSET:MBR_TABLE_OFFSET + 2 * MBR_ENTRY.size]))
+        _, partition_type, first_lba, _ = entries[0]
+        if partition_type and first_lba:
+            partitions.append((number, partition_type, (ebr_lba + first_lba) * sector_size))
+            number += 1
+        _, next_type, next_lba, _ = entries[1]
+        ebr_lba = extended_start + next_lba if next_type in EXTENDED_PARTITION_TYPES and next_lba else None
+    return partitions
+
+
+def gpt_partitions(volume: Volume) -> List[Tuple[int, bytes, int]] | None:
+    """
+    GPT のパーティションエントリから (番号, タイプGUID, 先頭のバイトオフセット) のリストを返す
+    LBA 1 のヘッダが壊れている場合は、ディスク末尾のバックアップヘッダを使う（どちらも無ければ None）
+    """
+    for sector_size in PARTITION_SECTOR_SIZES:
+        candidates = [sector_size] + ([volume.size - sector_size] if volume.size > 2 * sector_size else [])
+        for header_offset in candidates:
+            signature, entries_lba, entry_count, entry_size = GPT_HEADER.unpack(bytes(volume.read(header_offset, GPT_HEADER.size)).ljust(GPT_HEADER.size, b"\0"))
+            if signature != GPT_SIGNATURE or entry_size < 128 or not entry_count:
+                continue
+            table = volume.read(entries_lba * sector_size, min(entry_count, 1024) * entry_size)
+            partitions = []
+            for number in range(len(table) // entry_size):
+                entry = table[number * entry_size:(number + 1) * entry_size]
+                type_guid, first_lba = bytes(entry[:16]), unpack("<Q", entry[32:40])[0]
+                if any(type_guid) and first_lba:
+                    partitions.append((number + 1, type_guid, first_lba * sector_size))
+            return partitions
+    return None
+
+
+def find_fat32_volumes(source: str) -> List[str]:
+    """
+    読み込み元の FAT32 ボリュームを探し、スキャンできる読み込み元（パーティションは「パス@オフセット」）のリストを返す
+    先頭が FAT32 のブートセクタ（またはバックアップ）ならそのまま、MBR／GPT のディスクなら各パーティションを調べる
+    FAT32 が見つからない場合も読み込み元をそのまま返す（スキャン時にエラーを表示する）
+    """
+    path, base = split_source(source)
+    try:
+        volume = Volume(source, use_mmap=False, use_cache=False)
+    except OSError:
+        # 開けない場合のエラーはスキャン時に表示する
+        return [source]
+    with volume:
+        if find_boot_sector(volume)[0] is not None:
+            return [source]
+        if volume.read(510, 2) != b"\x55\xaa":
+            return [source]
+        mbr = mbr_partitions(volume)
+        if any(partition_type == GPT_PROTECTIVE_TYPE for _, partition_type, _ in mbr):
+            partitions = [(f"GPT パーティション {number}", type_guid == GPT_BASIC_DATA_GUID, offset) for number, type_guid, offset in gpt_partitions(volume) or []]
+        else:
+            partitions = [(f"MBR パーティション {number}（タイプ 0x{partition_type:02X}）", partition_type in FAT32_PARTITION_TYPES, offset) for number, partition_type, offset in mbr]
+        volumes = []
+        for name, expected, offset in partitions:
+            boot_sector, from_backup = find_boot_sector(volume, offset)
+            if boot_sector is None:
+                # FAT32 のはずのパーティションだけ知らせる（NTFS などは黙ってスキップ）
+                if expected:
+                    print(f"⚠ {name}: FAT32 のブートセクタが見つからないためスキップします（先頭 {offset:,} バイト）")
+                continue
+            note = "（バックアップブートセクタを使用）" if from_backup else ""
+            print(f"✅ {name}: FAT32 ボリューム（先頭 {offset:,} バイト）{note}")
+            volumes.append(f"{path}@{base + offset}")
+    return volumes or [source]
+
+
+class ScanSession:
+    """
+    Pythonからスキャンを呼び出すためのAPI（CLIのスキャンもこれを使う）
+    読み込み元を開いてブートセクタからボリューム情報を読み取り、条件に一致するエントリを DirEntry として順に返す
+    ボリューム情報はグローバル変数に設定するため、同時に使えるセッションは1つ
+
+        with ScanSession("card.img") as session:
+            for entry in session.entries(extensions=["JPG"], deleted_only=True):
+                print(entry.filename, entry.size)
+
+    image_to: スキャンと同時に読み込み元をこのイメージファイルへコピーする（以降の読み込み元はイメージ）
+    report: ブートセクタの内容を表示する
+    """
+
+    def __init__(self, source: str, image_to: str | None = None, report: bool = False):
+        global SOURCE
+        self.volume = ImagingVolume(source, image_to) if image_to else Volume(source)
+        try:
+            boot_sector, from_backup = find_boot_sector(self.volume)
+            if boot_sector is None:
+                raise BootSectorError("FAT32 のブートセクタが見つかりません。ドライブへのアクセスに問題があるかも...（MBR／GPT のディスクは find_fat32_volumes でパーティションを探してね）")
+            if from_backup:
+                print("⚠ ブートセクタが壊れているため、バックアップブートセクタを使います。")
+            else:
+                # データを読み込む（mmap 時はコピーなしのスライス）
+                boot_sector = self.volume.read(0, BOOT_READ_SIZE)
+            parse_boot_sector(boot_sector, report)
+            self.volume.limit_to_boot_sector()
+        except BaseException:
+            self.volume.close()
+            raise
+        SOURCE = absolute_source(source)
+        if image_to:
+            # FAT領域までをコピーしてからスキャン（データ領域はスキャンしながらコピー）
+            self.volume.copy_until(DATA_START_BYTE)
+            SOURCE = os.path.abspath(image_to)
+
+    def entries(self, scan_filter: ScanFilter | None = None, carve: bool = False, **predicates) -> Iterator[DirEntry]:
+        """
+        データ領域を先頭から順にスキャンし、見つけたエントリを1件ずつ返すジェネレータ（パスは設定しない）
+        scan_filter: ファイルの条件（省略時は predicates（ScanFilter の引数）から作成）
+        carve: クラスタ先頭のシグネチャからもファイルを探す
+        """
+        if scan_filter is None:
+            scan_filter = ScanFilter(**predicates)
+        lfn_buffer = []
+        for _, _, block_results in iter_scan_range(self.volume, DATA_START_BYTE, None, lfn_buffer, scan_filter, carve=carve):
+            for entry in block_results:
+                yield DirEntry(**entry)
+
+    def scan(self, scan_filter: ScanFilter | None = None, carve: bool = False, **predicates) -> List[DirEntry]:
+        """
+        データ領域全体をスキャンし、親ディレクトリを逆引きしてパスを設定したエントリのリストを返す
+        """
+        scan_results = [entry.as_dict() for entry in self.entries(scan_filter, carve, **predicates)]
+        resolve_paths(scan_results)
+        return [DirEntry(**entry) for entry in scan_results]
+
+    def close(self):
+        self.volume.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_raw_data(source: str, scan_filter: ScanFilter | List[str], db_file: str, jobs: int = 1, strategy: str = "sweep", prefilter: bool = False, resume: bool = False, image_to: str | None = None, carve: bool = False) -> bool:
+    """
+    ドライブ（またはブロックデバイス・イメージファイル）をスキャンして、復旧可能なエントリをスキャン結果ストアに保存する
+    source: ドライブレター／ブロックデバイス／イメージファイルのパス
+    scan_filter: 対象とするファイルの条件（拡張子のリストも可）
+    戻り値: スキャン結果を保存できたか
+    strategy: "sweep"（データ領域全体を走査） or "tree"（ルートディレクトリからディレクトリツリーを辿る）
+    prefilter: スイープ時、ディレクトリ候補のクラスタだけを解析する
+    resume: 逐次スイープを最後のチェックポイントから再開する
+    image_to: 逐次スイープと同時に読み込み元をこのイメージファイルへコピーし、以降の復元はイメージから行う
+    carve: スイープ時、クラスタ先頭のシグネチャからもファイルを探す（ディレクトリエントリが上書きされている場合向け）
+    """
+    # ドライブレターの場合、Windowsでは「\\.\」を前につけて特殊なデバイスとして扱う必要があるわ。
+    drive_path = volume_path(source)
+    if not isinstance(scan_filter, ScanFilter):
+        scan_filter = ScanFilter(extensions=scan_filter)
+    
+    try:
+        # バイナリ読み込みモード ('rb') でドライブを開く
+        print(f"[{drive_path}] の生データ読み込みを開始します...")
+
+        with ScanSession(source, image_to, report=True) as session:
+            volume = session.volume
+            scan_stats = {"clusters_scanned": 0, "clusters_skipped": 0}
+            with run_stats.phase("scan"):
+                if strategy == "tree":
+                    # ディレクトリツリーを辿って、ディレクトリのクラスタだけをスキャン
+                    scan_results = scan_tree(volume, scan_filter)
+                elif jobs > 1:
+                    # 複数プロセスで範囲ごとに並列スキャン
+                    scan_results = scan_partitioned(volume, scan_filter, jobs, prefilter, scan_stats, carve)
+                else:
+                    # 進捗をチェックポイントとして保存しながら逐次スキャン
+                    scan_results = scan_with_checkpoints(volume, db_file, scan_filter, prefilter, scan_stats, resume, carve)
+            # 実行統計（ワーカープロセスの読み込みは scan_stats に集計済み）
+            run_stats.record_volume(volume)
+            for key, value in scan_stats.items():
+                run_stats.count(key, value)
+            if scan_results is None:
+                return False
+            run_stats.count("entries_matched", len(scan_results))
+            if carve:
+                # カービングの結果もディスク上の位置順に並べる（同じ位置ではディレクトリエントリが先）
+                scan_results.sort(key=lambda entry: (entry["current_byte"], entry.get("origin") == "carve"))
+                run_stats.count("files_carved", sum(1 for entry in scan_results if entry.get("origin") == "carve"))
+            if volume.cache is not None:
+                print(volume.cache.summary())
+            if prefilter and strategy != "tree":
+                print(f"ディレクトリ候補のクラスタ {scan_stats['clusters_scanned']:,} 件を解析し、{scan_stats['clusters_skipped']:,} 件をスキップしました。")
+            # スイープ時は親ディレクトリを逆引きしてパスを設定（ツリー巡回ではパスが判明済み）
+            if strategy != "tree":
+                with run_stats.phase("resolve_paths"):
+                    resolve_paths(scan_results)
+            # スキャン結果ストアに保存
+            with run_stats.phase("save_store"):
+                save_to_store(scan_results, db_file)
+            return True
+    except BootSectorError as e:
+        print(f"⚠ {e}")
     except FileNotFoundError:
         print(f"エラー: ドライブ [{drive_path}] が見つかりません。接続を確認してね。")
     except PermissionError:
@@ -535,6 +2822,91 @@ def read_raw_data(drive_letter: str, target_exts: List[str], xlsx_file: str):
         )
     except Exception as e:
         print(f"予期せぬエラーが発生しました: {e}")
+    return False
+
+
+def discover_volumes(targets: List[str]) -> List[Tuple[str, str]]:
+    """
+    指定された読み込み元（ドライブ・イメージ・ディスク）から FAT32 ボリュームを探し、(ボリュームの名前, 読み込み元) のリストを返す
+    名前は出力ファイル名に付けるもので、イメージのファイル名（複数のパーティションがあれば _p1, _p2, ...）
+    """
+    discovered = []
+    for target in targets:
+        found = find_fat32_volumes(target)
+        stem = os.path.splitext(os.path.basename(split_source(target)[0].rstrip("\\/:")))[0] or "volume"
+        for number, source in enumerate(found, 1):
+            name = f"{stem}_p{number}" if len(found) > 1 else stem
+            # 同じファイル名のイメージは番号で区別する
+            while name in (known for known, _ in discovered):
+                name += f"_{len(discovered) + 1}"
+            discovered.append((name, source))
+    return discovered
+
+
+def named_output(path: str, name: str) -> str:
+    """
+    出力ファイル名にボリュームの名前を付ける（例: scan.xlsx → scan_card.xlsx）
+    """
+    stem, ext = os.path.splitext(path)
+    return f"{stem}_{name}{ext}"
+
+
+def scan_volume(source: str, scan_filter: ScanFilter, db_file: str, xlsx_file: str | None, log_file: str, stats_json: str | None, settings: dict, options: dict) -> Tuple[bool, int]:
+    """
+    1つのボリュームをスキャンしてストア（と Excel）に保存する（scan_volumes のワーカープロセスで実行）
+    表示はボリュームごとのログファイルに書き出す
+    戻り値: (スキャン結果を保存できたか, 見つけたエントリ数)
+    """
+    global run_stats
+    globals().update(settings)
+    # ワーカープロセスは使い回されるため、実行統計はボリュームごとに作り直す
+    run_stats = RunStats()
+    with open(log_file, "w", encoding="utf-8") as log, contextlib.redirect_stdout(log):
+        saved = read_raw_data(source, scan_filter, db_file, **options)
+        if saved and xlsx_file:
+            with run_stats.phase("export_excel"):
+                export_excel(db_file, xlsx_file)
+        if stats_json:
+            run_stats.save(stats_json, "scan", SOURCE or source)
+    return saved, run_stats.counters.get("entries_matched", 0)
+
+
+def scan_volumes(discovered: List[Tuple[str, str]], scan_filter: ScanFilter, db_file: str, xlsx_file: str | None, jobs: int = 1, stats_json: str | None = None, **options) -> int:
+    """
+    複数のボリューム（イメージ・パーティション）を、ボリュームごとのワーカープロセスで同時にスキャンする
+    ストア・Excel・実行統計・ログは、ファイル名にボリュームの名前を付けてボリュームごとに書き出す
+    discovered: discover_volumes の戻り値
+    jobs: 同時にスキャンするボリューム数（各ボリュームは逐次スキャン）
+    options: read_raw_data の引数（strategy, prefilter, resume, carve）
+    戻り値: スキャン結果を保存できたボリューム数
+    """
+    # 先読み・キャッシュの設定はワーカープロセスにも引き継ぐ
+    settings = {name: globals()[name] for name in ("CACHE_BLOCK_SIZE", "CACHE_BLOCKS", "CACHE_FAT_READAHEAD", "CACHE_DATA_READAHEAD", "CACHE_BYPASS_BLOCKS", "READ_AHEAD_BLOCKS", "VERBOSE")}
+    print(f"{len(discovered)} 個のボリュームを {min(jobs, len(discovered))} 並列でスキャンします...")
+    saved_volumes = 0
+    with ProcessPoolExecutor(max_workers=min(jobs, len(discovered))) as executor:
+        futures = {}
+        for name, source in discovered:
+            outputs = (
+                named_output(db_file, name),
+                xlsx_file and named_output(xlsx_file, name),
+                named_output(db_file, name).removesuffix(".db") + ".log",
+                stats_json and named_output(stats_json, name),
+            )
+            futures[executor.submit(scan_volume, source, scan_filter, *outputs, settings, options)] = (name, source, outputs)
+        for future in as_completed(futures):
+            name, source, (volume_db, volume_xlsx, log_file, _) = futures[future]
+            try:
+                saved, entries = future.result()
+            except Exception as e:
+                print(f"❌ {name} [{source}]: 予期せぬエラーが発生しました: {e}（ログ: {log_file}）")
+                continue
+            if saved:
+                saved_volumes += 1
+                print(f"✅ {name} [{source}]: {entries:,} 件 → {volume_db}{f' / {volume_xlsx}' if volume_xlsx else ''}（ログ: {log_file}）")
+            else:
+                print(f"❌ {name} [{source}]: スキャンできませんでした（ログ: {log_file}）")
+    return saved_volumes
 
 
 if __name__ == "__main__":
@@ -542,10 +2914,10 @@ if __name__ == "__main__":
         description="FAT32ドライブからデータを復旧"
     )
 
-    parser.add_argument("--target_drive", "-t", type=str, required=True, help="復旧対象ドライブレター（a,b,c,...）")
+    parser.add_argument("--target_drive", "-t", type=str, nargs="+", help="復旧対象（ドライブレター a,b,c,... ／ブロックデバイス／イメージファイルのパス）。MBR／GPT のディスクは FAT32 のパーティションを探す。スキャンモードでは複数指定でき、ボリュームごとに同時にスキャンする。復元モードでは省略するとスキャン時の読み込み元を使う")
     
     run_mode = parser.add_mutually_exclusive_group(required=True)  # 同グループ内のどれか必須
-    run_mode.add_argument("--scan", "-s", action="store_true", help="スキャンモード実行（スキャン結果をエクセルファイルに保存）")
+    run_mode.add_argument("--scan", "-s", action="store_true", help="スキャンモード実行（スキャン結果をストアに保存し、エクセルファイルに書き出し）")
     run_mode.add_argument("--restore", "-r", action="store_true", help="復元モードで実行（スキャン結果ファイル中の復旧フラグファイルを復元）")
 
     parser.add_argument(
@@ -555,19 +2927,117 @@ if __name__ == "__main__":
         default=["DOC", "XLS", "JPG", "PDF", "PNG", "PPT", "PAG"] ,
         help="復旧対象とする拡張子（スペースで区切って複数指定可）"
     )
-    parser.add_argument("--xlsx_file", "-x", type=str, required=False, help="復旧対象ドライブレター（a,b,c,...）", default='fat32_scan_results.xlsx')
+    parser.add_argument(
+        "--strategy",
+        choices=["sweep", "tree"],
+        default="sweep",
+        help="スキャン方法（sweep: データ領域全体を走査／孤立したディレクトリも検出, tree: ルートからディレクトリツリーを辿る）"
+    )
+    parser.add_argument("--prefilter", action="store_true", help="スイープ時、ディレクトリらしくないクラスタを簡易判定でスキップする")
+    parser.add_argument("--carve", action="store_true", help="スイープ時、クラスタ先頭のシグネチャ（JPG/PNG/PDF/DOC/XLS/PPT/PAG）からもファイルを探して切り出す")
+    parser.add_argument("--resume", action="store_true", help="中断したスキャンを最後のチェックポイントから再開する（逐次スイープのみ）")
+    parser.add_argument("--image-to", type=str, help="スキャンと同時に読み込み元をイメージファイルにコピーする（劣化したメディア向け。読めない範囲は <イメージ>.badblocks に記録）")
+    parser.add_argument("--cache-block-size", type=int, default=CACHE_BLOCK_SIZE, help="ブロックキャッシュの1ブロックのサイズ（バイト、512の倍数。mmap できないドライブで使用）")
+    parser.add_argument("--cache-blocks", type=int, default=CACHE_BLOCKS, help="ブロックキャッシュに保持する最大ブロック数")
+    parser.add_argument("--fat-readahead", type=int, default=CACHE_FAT_READAHEAD, help="FAT領域でキャッシュミス時に先読みするブロック数")
+    parser.add_argument("--data-readahead", type=int, default=CACHE_DATA_READAHEAD, help="データ領域でキャッシュミス時に先読みするブロック数")
+    parser.add_argument("--cache-bypass-blocks", type=int, default=CACHE_BYPASS_BLOCKS, help="データ領域でこのブロック数より長い読み込みはキャッシュを通さず、直接読み込む")
+    parser.add_argument("--read-ahead", type=int, default=READ_AHEAD_BLOCKS, help="スキャン時に別スレッドで先読みしておくブロック数（0 で先読みしない）")
+    parser.add_argument("--verbose", "-v", action="store_true", help="見つけたエントリ・復元したファイルを1件ずつ表示する（既定は一定間隔の進捗表示のみ）")
+    parser.add_argument("--stats-json", type=str, help="実行統計（フェーズごとの所要時間・読み込みバイト数・読み込み回数・件数）を書き出すJSONファイル")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="並列数（スキャンモード: ワーカープロセス数（ボリュームが複数なら同時にスキャンするボリューム数）, 復元モード: 同時に読み書きするファイル数）")
+    parser.add_argument("--verify-fat", action="store_true", help="復元時にFAT1とFAT2（ミラー）の食い違いをチェックする")
+    parser.add_argument("--free-map", action="store_true", help="削除済みファイルは、先頭クラスタ以降の空きクラスタを順に使っていたとみなして復元する（FATのチェーンが消えているため）")
+    parser.add_argument("--xlsx_file", "-x", type=str, required=False, help="スキャン結果を書き出す／復旧チェックを取り込むExcelファイル", default='fat32_scan_results.xlsx')
+    parser.add_argument("--no-xlsx", action="store_true", help="Excelファイルへの書き出しを行わない")
+    parser.add_argument("--db", type=str, default="fat32_scan_results.db", help="スキャン結果ストア（SQLite）のファイル")
+    parser.add_argument("--ids", type=int, nargs="+", help="復元モードで復元対象にするエントリのID（Excel の ID 列）")
+    parser.add_argument("--select-ext", nargs="+", help="復元モードで復元対象にする拡張子（スペースで区切って複数指定可）")
+    parser.add_argument("--deleted-only", action="store_true", help="削除済みのファイルのみを対象にする（スキャンモード: スキャン結果, 復元モード: 復元対象）")
+    parser.add_argument("--name", type=str, help="スキャンモードで対象にするファイル名のパターン（例: \"IMG_*\"、大文字・小文字は区別しない）")
+    parser.add_argument("--min-size", type=int, help="スキャンモードで対象にするファイルの最小サイズ（バイト）")
+    parser.add_argument("--max-size", type=int, help="スキャンモードで対象にするファイルの最大サイズ（バイト）")
+    parser.add_argument("--modified-after", type=datetime.fromisoformat, help="スキャンモードで対象にするファイルの更新日時の下限（例: 2024-01-31 または \"2024-01-31 12:00:00\"）")
+    parser.add_argument("--modified-before", type=datetime.fromisoformat, help="スキャンモードで対象にするファイルの更新日時の上限")
     
     args = parser.parse_args()
-    target_drive = args.target_drive
+    if args.resume and (args.jobs > 1 or args.strategy != "sweep"):
+        parser.error("--resume は逐次スイープ（--strategy sweep, --jobs 1）でのみ使用できます")
+    if args.image_to and (args.jobs > 1 or args.strategy != "sweep" or args.resume):
+        parser.error("--image-to は逐次スイープ（--strategy sweep, --jobs 1）でのみ使用でき、--resume とは併用できません")
+    if args.carve and args.strategy != "sweep":
+        parser.error("--carve はスイープ（--strategy sweep）でのみ使用できます")
+    if args.read_ahead < 0:
+        parser.error("--read-ahead は0以上で指定してください")
+    if args.cache_block_size <= 0 or args.cache_block_size % 512:
+        parser.error("--cache-block-size は512の倍数で指定してください")
+    CACHE_BLOCK_SIZE = args.cache_block_size
+    CACHE_BLOCKS = args.cache_blocks
+    CACHE_FAT_READAHEAD = args.fat_readahead
+    CACHE_DATA_READAHEAD = args.data_readahead
+    CACHE_BYPASS_BLOCKS = args.cache_bypass_blocks
+    READ_AHEAD_BLOCKS = args.read_ahead
+    VERBOSE = args.verbose
+    if args.scan and not args.target_drive:
+        parser.error("スキャンモードでは --target_drive が必要です")
+    if args.restore and args.target_drive and len(args.target_drive) > 1:
+        parser.error("復元モードでは --target_drive は1つだけ指定できます")
+    target_drive = args.target_drive[0] if args.target_drive else None
     xlsx_file = args.xlsx_file
-    target_exts = [ext.upper() for ext in args.extensions]  # 大文字に揃える
+    db_file = args.db
+    # スキャン結果に含めるファイルの条件（拡張子は ScanFilter で大文字に揃える）
+    scan_filter = ScanFilter(
+        extensions=args.extensions,
+        name=args.name,
+        min_size=args.min_size,
+        max_size=args.max_size,
+        modified_after=args.modified_after,
+        modified_before=args.modified_before,
+        deleted_only=args.deleted_only,
+    )
 
+    discovered = []
     if args.scan:
-        read_raw_data(target_drive, target_exts, xlsx_file)
-        lookup_path(xlsx_file)
+        # MBR／GPT のディスクは FAT32 のパーティションごとのボリュームに分ける
+        discovered = discover_volumes(args.target_drive)
+        if len(discovered) > 1 and args.image_to:
+            parser.error("--image-to はボリュームが1つの場合のみ使用できます")
+        target_drive = discovered[0][1]
+
+    if len(discovered) > 1:
+        # ボリュームごとのワーカープロセスで同時にスキャン（ボリュームの中は逐次スキャン）
+        scan_volumes(discovered, scan_filter, db_file, None if args.no_xlsx else xlsx_file, args.jobs, args.stats_json,
+                     strategy=args.strategy, prefilter=args.prefilter, resume=args.resume, carve=args.carve)
+    elif args.scan:
+        if read_raw_data(target_drive, scan_filter, db_file, args.jobs, args.strategy, args.prefilter, args.resume, args.image_to, args.carve):
+            if not args.no_xlsx:
+                with run_stats.phase("export_excel"):
+                    export_excel(db_file, xlsx_file)
     
     elif args.restore:
-        if not os.path.exists(xlsx_file):
-            sys.exit(f"エクセルファイル: {xlsx_file}が見つかりません！")
-        salvage_file(xlsx_file)
+        if os.path.exists(db_file):
+            # 復元対象の選択（ID／条件指定、なければExcelの復旧チェック列）
+            with run_stats.phase("select"):
+                if args.ids or args.select_ext or args.deleted_only:
+                    select_entries(db_file, args.ids, [ext.upper() for ext in args.select_ext or []], args.deleted_only)
+                elif os.path.exists(xlsx_file):
+                    import_excel_selection(db_file, xlsx_file)
+            with run_stats.phase("restore"):
+                salvage_from_store(db_file, args.verify_fat, args.jobs, target_drive, args.free_map)
+            # Excelファイルにも復元結果を反映
+            if not args.no_xlsx and os.path.exists(xlsx_file):
+                with run_stats.phase("export_excel"):
+                    export_excel(db_file, xlsx_file)
+        elif os.path.exists(xlsx_file):
+            # スキャン結果ストアがない場合は、Excelファイルから直接復元
+            with run_stats.phase("restore"):
+                salvage_file(xlsx_file, args.verify_fat, args.jobs, target_drive, args.free_map)
+        else:
+            sys.exit(f"スキャン結果ストア: {db_file} もエクセルファイル: {xlsx_file} も見つかりません！")
 
+    if args.stats_json and len(discovered) <= 1:
+        # 複数ボリュームの実行統計はボリュームごとに書き出し済み
+        # 復元・ツリー巡回で開いたボリュームの読み込みも集計
+        for volume in volumes.values():
+            run_stats.record_volume(volume)
+        run_stats.save(args.stats_json, "scan" if args.scan else "restore", SOURCE or target_drive)